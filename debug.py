@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 import logging
+import os
+import statistics
 import sys
+import tempfile
+import time
 from datetime import datetime
 
+from PIL import Image
 from pytz import timezone
 
 from modules.calendar import Calendar, get_months_preview
 from modules.config import ConfigLoader
+from modules import metrics
 from modules.logger import log_setup
 from modules.power import Power
-from modules.render import TemplateRenderer
+from modules.render import get_renderer
 from modules.schedule import Scheduler
 from modules.weather import ForecastConditionEnum, Weather
 
@@ -44,13 +50,180 @@ elif cmd == "battery":
     power = Power()
     print(power.battery_status)
 elif cmd == "render":
-    renderer = TemplateRenderer(config)
+    renderer = get_renderer(config)
     calendar = Calendar(config)
     calendar.load_events()
     weather_forecast = None
     if config.weather.is_enabled:
         weather_forecast = Weather(config).forecast
-    renderer.render(calendar, weather_forecast=weather_forecast)
+    black_buffer, red_buffer = renderer.render(calendar, weather_forecast=weather_forecast)
+    Image.frombytes("1", (config.screen_width, config.screen_height), black_buffer).save(f"{renderer.workdir}/black.png")
+    Image.frombytes("1", (config.screen_width, config.screen_height), red_buffer).save(f"{renderer.workdir}/red.png")
+    print(f"Planes saved to {renderer.workdir}")
+elif cmd == "benchmark":
+    # Runs display driver against simulated panel, times are estimated for the device
+    os.environ["MAGINKCAL_EPD"] = "simulator"
+    from display import epdconfig
+    from display.display import Display
+
+    renderer = get_renderer(config)
+    calendar = Calendar(config)
+    calendar.load_events()
+    black_buffer, red_buffer = renderer.render(calendar)
+    changed_red_buffer = red_buffer[:-1] + bytes([red_buffer[-1] ^ 0xff])
+
+    simulator = epdconfig.implementation
+    display_service = Display(config.screen_width, config.screen_height)
+    with tempfile.TemporaryDirectory() as workdir:
+        display_service.workdir = workdir
+        display_service.frame_path = f"{workdir}/frame"
+        display_service.state_path = f"{workdir}/display_state.json"
+        scenarios = (
+            ("full update", lambda: display_service.update(black_buffer, red_buffer), (black_buffer, red_buffer)),
+            ("unchanged", lambda: display_service.update(black_buffer, red_buffer), (black_buffer, red_buffer)),
+            (
+                "bottom half changed",
+                lambda: display_service.update(black_buffer, changed_red_buffer),
+                (black_buffer, changed_red_buffer),
+            ),
+            (
+                "partial window",
+                lambda: display_service.update(
+                    black_buffer, red_buffer, dirty_rects=display_service.get_dirty_rects(black_buffer, red_buffer, 1)
+                ),
+                (black_buffer, red_buffer),
+            ),
+            ("calibration cycle", lambda: display_service.calibrate(cycles=1), None),
+        )
+        for name, scenario, expected_frame in scenarios:
+            simulator.reset_stats()
+            start = time.perf_counter()
+            scenario()
+            cpu_time = time.perf_counter() - start
+            report = simulator.get_report()
+            print(f"{name}:")
+            print(f"  host time: {cpu_time:.3f}s, estimated device time: {report['elapsed']:.3f}s")
+            print(f"  SPI: {report['spi_bytes']} bytes in {report['spi_calls']} calls, "
+                  f"GPIO: {report['gpio_writes']} writes, {report['gpio_reads']} reads, "
+                  f"busy polls: {report['busy_polls']}, refreshes: {report['refreshes']}")
+            if expected_frame:
+                print(f"  panel matches frame: {simulator.get_frame() == expected_frame}")
+        display_service.sleep()
+elif cmd == "calendar_benchmark":
+    # Loads synthetic feeds served from a local HTTP server, time and peak memory are measured per stage
+    import http.server
+    import threading
+    import tracemalloc
+
+    from modules.config import Calendar as CalendarConfig
+    from modules.ical import build_event, read_components
+    from modules.icsgen import generate_feed
+
+    feeds = {}
+
+    class FeedHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = feeds[self.path]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/calendar; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def measure(stage, prepare=None):
+        # Runs the stage twice, timing isn't disturbed by tracemalloc, returns result of the first run.
+        # prepare runs before each of them and isn't measured.
+        if prepare:
+            prepare()
+        start = time.perf_counter()
+        result = stage()
+        duration = time.perf_counter() - start
+        if prepare:
+            prepare()
+        tracemalloc.start()
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, duration, peak
+
+    def new_calendar(workdir):
+        calendar = Calendar(config.copy(update={"calendars": [CalendarConfig(url=f"{url}/feed.ics")]}))
+        calendar.workdir = workdir
+        calendar.events_cache_path = f"{workdir}/events.bin"
+        return calendar
+
+    def parse(calendar, ics_path):
+        with open(ics_path, encoding="utf-8") as ics_file:
+            return [build_event(component, timezones) for component, timezones in read_components(ics_file, calendar.timezone)]
+
+    def bucket(calendar, records):
+        calendar.day_events = [[] for _ in calendar.day_events]
+        for record in records:
+            calendar._add_event(record)
+
+    sizes = (
+        ("small", dict(single_events=500, recurring_events=50, all_day_events=50)),
+        ("default", dict()),
+        ("large", dict(single_events=10000, recurring_events=1000, all_day_events=1000)),
+    )
+    for name, size in sizes:
+        feeds["/feed.ics"] = generate_feed(**size).encode("utf-8")
+        with tempfile.TemporaryDirectory() as workdir:
+            calendar = new_calendar(workdir)
+            results = []
+            (ics_path, _), duration, peak = measure(lambda: calendar._fetch_calendars()[0])
+            results.append(("download", duration, peak, ""))
+            events, duration, peak = measure(lambda: parse(calendar, ics_path))
+            results.append(("parse", duration, peak, f"{len(events)} events"))
+            records, duration, peak = measure(
+                lambda: [record for event in events for record in calendar._expand_event(event)]
+            )
+            results.append(("expand", duration, peak, f"{len(records)} occurrences"))
+            _, duration, peak = measure(lambda: bucket(calendar, records))
+            results.append(("bucket", duration, peak, f"{sum(map(len, calendar.day_events))} day entries"))
+            _, duration, peak = measure(calendar._sort_events, prepare=lambda: bucket(calendar, records))
+            results.append(("sort", duration, peak, ""))
+            _, duration, peak = measure(calendar.save_events)
+            results.append(("save", duration, peak, f"{os.path.getsize(calendar.events_cache_path)} bytes"))
+
+            def remove_caches():
+                for cache_file in os.listdir(f"{workdir}/calendars"):
+                    os.remove(f"{workdir}/calendars/{cache_file}")
+
+            _, duration, peak = measure(lambda: new_calendar(workdir).load_events(), prepare=remove_caches)
+            results.append(("load_events cold", duration, peak, ""))
+            _, duration, peak = measure(lambda: new_calendar(workdir).load_events())
+            results.append(("load_events unchanged", duration, peak, ""))
+        print(f"{name} feed, {len(feeds['/feed.ics']) / 1024:.0f} kB:")
+        for stage, duration, peak, note in results:
+            print(f"  {stage:22} {duration:8.3f}s {peak / 1024 / 1024:8.1f} MB  {note}")
+    server.shutdown()
+elif cmd == "metrics":
+    # Stage durations of recorded runs, median of the last 10 runs next to the 10 before them shows the trend
+    records = metrics.read_records()
+    print(f"{len(records)} runs recorded, {sum(record['status'] != 'ok' for record in records)} failed")
+    if records:
+        print(f"Last run: {records[-1]['time']}, {records[-1]['duration']:.2f}s")
+        stages = sorted({name for record in records for name in record["stages"]} | {"total"})
+        print(f"  {'stage':24} {'last':>8} {'median':>8} {'p90':>8} {'max':>8} {'recent':>8} {'before':>8}")
+        for stage in stages:
+            durations = [
+                record["duration"] if stage == "total" else record["stages"][stage]
+                for record in records
+                if stage == "total" or stage in record["stages"]
+            ]
+            ordered = sorted(durations)
+            recent = statistics.median(durations[-10:])
+            before = f"{statistics.median(durations[-20:-10]):8.3f}" if len(durations) > 10 else f"{'-':>8}"
+            print(f"  {stage:24} {durations[-1]:8.3f} {statistics.median(durations):8.3f} "
+                  f"{ordered[int(0.9 * (len(ordered) - 1))]:8.3f} {ordered[-1]:8.3f} {recent:8.3f} {before}")
 elif cmd == "weather":
     forecast = Weather(config).forecast
     print(forecast.day)
@@ -1,7 +1,11 @@
 import display.epd12in48b as eink
+import json
 import logging
+import os
+import pathlib
+import time
 
-from PIL import Image
+from modules import metrics
 
 
 class Display:
@@ -9,27 +13,142 @@ class Display:
         self.logger = logging.getLogger('MagInkCal')
         self.screen_width = width
         self.screen_height = height
+        self.workdir = f"{pathlib.Path(__file__).parent.parent.absolute()}/build"
+        self.frame_path = f"{self.workdir}/frame"
+        self.state_path = f"{self.workdir}/display_state.json"
         self.epd = eink.EPD()
         self.epd.Init()
+        self.refresh = None
+        self.frame = None
+        self.previous_frame = None
 
-    def update(self, black_image, red_image):
-        # Updates the display with the grayscale and red images
+    def update(self, black_buffer, red_buffer, wait=True, dirty_rects=None):
+        # Updates the display with packed black and red planes (see modules.planes.pack_planes)
+        # With wait=False returns as soon as the panel starts refreshing, returned handle tells when it's done
+        # dirty_rects, boxes (left, top, right, bottom) covering everything that changed, switch to partial refresh
+        # of windows around them, otherwise only halves of the panel that differ from the last displayed frame
+        # are uploaded and refreshed
         # start displaying on eink display
         # self.epd.clear()
-        self.epd.display(black_image, red_image)
-        self.logger.info('E-Ink display update complete.')
+        self.previous_frame = self._load_frame()
+        with metrics.span("display.upload", partial=dirty_rects is not None):
+            if dirty_rects is None:
+                self.refresh = self.epd.display(black_buffer, red_buffer, False, self.previous_frame)
+            else:
+                self.refresh = self.epd.display_partial(black_buffer, red_buffer, dirty_rects, False)
+        self.frame = (black_buffer, red_buffer)
+        if wait:
+            self.wait()
+        else:
+            self.logger.info('E-Ink display refresh started.')
+        return self.refresh
+
+    def wait(self):
+        # Waits for refresh started by update(wait=False)
+        if self.refresh and not self.refresh.finished:
+            with metrics.span("display.busy_wait"):
+                self.refresh.wait()
+            self.logger.info('E-Ink display update complete.')
+        if self.frame:
+            self._save_frame(*self.frame)
+            self._count_refresh(self.previous_frame, self.frame)
+            self.frame = None
+
+    def get_dirty_rects(self, black_buffer, red_buffer, max_part):
+        # Areas that changed since the last update, None when they cover more than max_part of the screen
+        # or the last frame is unknown, full refresh should be used then
+        previous_frame = self._load_frame()
+        if previous_frame is None or not max_part:
+            return None
+        dirty_rects = self.epd.GetDirtyRects(black_buffer, red_buffer, previous_frame)
+        area = sum((right - left) * (bottom - top) for left, top, right, bottom in dirty_rects)
+        if area > max_part * self.screen_width * self.screen_height:
+            return None
+        return dirty_rects
+
+    def needs_calibration(self, max_refreshes, max_changed, max_days):
+        # Ghosting builds up with every refresh and every changed pixel, calibration is due once any limit is reached.
+        # max_changed is the sum of changed parts of the screen, 1.0 being the whole screen once.
+        state = self._load_state()
+        if state["refreshes"] >= max_refreshes:
+            self.logger.info(f"Calibration needed after {state['refreshes']} refreshes")
+            return True
+        if state["changed"] >= max_changed:
+            self.logger.info(f"Calibration needed after changing {state['changed']:.2f} screens")
+            return True
+        if state["calibrated_at"] is None or time.time() - state["calibrated_at"] >= max_days * 24 * 3600:
+            self.logger.info("Calibration needed, last one is too old")
+            return True
+        return False
 
     def calibrate(self, cycles=1):
-        # Calibrates the display to prevent ghosting
-        white = Image.new('1', (self.screen_width, self.screen_height), 'white')
-        black = Image.new('1', (self.screen_width, self.screen_height), 'black')
-        for _ in range(cycles):
-            self.epd.display(black, white)
-            self.epd.display(white, black)
-            self.epd.display(white, white)
+        # Calibrates the display to prevent ghosting, frames are constant so a cycle only costs transfers and refreshes
+        with metrics.span("display.calibrate", cycles=cycles):
+            for _ in range(cycles):
+                self.epd.display(eink.BLACK_BUFFER, eink.NO_RED_BUFFER)
+                self.epd.display(eink.WHITE_BUFFER, eink.RED_BUFFER)
+                self.epd.display(eink.WHITE_BUFFER, eink.NO_RED_BUFFER)
+        if cycles:
+            self._save_frame(eink.WHITE_BUFFER, eink.NO_RED_BUFFER)
+            self._save_state({"refreshes": 0, "changed": 0.0, "calibrated_at": time.time()})
         self.logger.info('E-Ink display calibration complete.')
 
     def sleep(self):
         # send E-Ink display to deep sleep
-        self.epd.EPD_Sleep()
+        self.wait()
+        with metrics.span("display.sleep"):
+            self.epd.EPD_Sleep()
         self.logger.info('E-Ink display entered deep sleep.')
+
+    def _load_frame(self):
+        # Returns (black_buffer, red_buffer) shown on the panel after last update, if known
+        try:
+            with open(self.frame_path, "rb") as frame_file:
+                frame = frame_file.read()
+        except OSError:
+            return None
+        size = self.epd.buffer_size
+        if len(frame) != 2 * size:
+            return None
+        return frame[:size], frame[size:]
+
+    def _save_frame(self, black_buffer, red_buffer):
+        os.makedirs(self.workdir, exist_ok=True)
+        with open(f"{self.frame_path}.tmp", "wb") as frame_file:
+            frame_file.write(black_buffer)
+            frame_file.write(red_buffer)
+        os.replace(f"{self.frame_path}.tmp", self.frame_path)
+
+    def _count_refresh(self, previous_frame, frame):
+        if previous_frame is None:
+            changed = 1.0
+        else:
+            changed = self._get_changed_part(previous_frame, frame)
+        if not changed:
+            return
+        state = self._load_state()
+        state["refreshes"] += 1
+        state["changed"] += changed
+        self._save_state(state)
+
+    def _get_changed_part(self, previous_frame, frame):
+        # Part of the screen where either plane changed
+        (previous_black, previous_red), (black, red) = previous_frame, frame
+        changed = (
+            (int.from_bytes(previous_black, "big") ^ int.from_bytes(black, "big"))
+            | (int.from_bytes(previous_red, "big") ^ int.from_bytes(red, "big"))
+        )
+        return bin(changed).count("1") / (len(black) * 8)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {"refreshes": 0, "changed": 0.0, "calibrated_at": None}
+
+    def _save_state(self, state):
+        os.makedirs(self.workdir, exist_ok=True)
+        with open(f"{self.state_path}.tmp", "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
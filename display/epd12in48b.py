@@ -26,16 +26,42 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
+import threading
 import time
 import display.epdconfig as epdconfig
 
 EPD_WIDTH       = 1304
 EPD_HEIGHT      = 984
+EPD_ROW_BYTES   = 163
+EPD_BUFFER_SIZE = EPD_ROW_BYTES * EPD_HEIGHT
+
+# Constant frames, black plane bits are set for white pixels, red plane bits are set for red pixels
+WHITE_BUFFER    = bytes([0xff]) * EPD_BUFFER_SIZE
+BLACK_BUFFER    = bytes(EPD_BUFFER_SIZE)
+RED_BUFFER      = bytes([0xff]) * EPD_BUFFER_SIZE
+NO_RED_BUFFER   = bytes(EPD_BUFFER_SIZE)
+
+# Part of the frame each controller owns: (rows range, byte columns range)
+S2_PART = ((0, 492), (0, 81))       # 648*492
+M2_PART = ((0, 492), (81, 163))     # 656*492
+M1_PART = ((492, 984), (0, 81))     # 648*492
+S1_PART = ((492, 984), (81, 163))   # 656*492
+
+# Cascaded controllers share reset and DC lines and lose their SRAM on reset,
+# so each pair is uploaded and refreshed as a whole: M2 with S2 on top, M1 with S1 at the bottom
+CONTROLLERS = ("S2", "M2", "M1", "S1")
+TOP_HALF = ((0, 492), (0, 163))
+BOTTOM_HALF = ((492, 984), (0, 163))
+
+# How often controllers are asked for their status while waiting, in case BUSY edge was missed
+BUSY_POLL_INTERVAL = 1
 
 class EPD(object):
     def __init__(self):
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.buffer_size = EPD_BUFFER_SIZE
+        self.partial = set()
         
         self.EPD_M1_CS_PIN  = epdconfig.EPD_M1_CS_PIN
         self.EPD_S1_CS_PIN  = epdconfig.EPD_S1_CS_PIN
@@ -74,52 +100,27 @@ class EPD(object):
         self.S2_SendData(0x23) 
 
         # POWER SETTING
+        # VGH=20V,VGL=-20V, VDH=15V, VDL=-15V
         self.M1_SendCommand(0x01)
-        self.M1_SendData(0x07)
-        self.M1_SendData(0x17)	# VGH=20V,VGL=-20V
-        self.M1_SendData(0x3F)   # VDH=15V
-        self.M1_SendData(0x3F)   # VDL=-15V
-        self.M1_SendData(0x0d)
+        self.M1_SendBuffer(bytes([0x07, 0x17, 0x3F, 0x3F, 0x0d]))
         self.M2_SendCommand(0x01)
-        self.M2_SendData(0x07)
-        self.M2_SendData(0x17)	# VGH=20V,VGL=-20V
-        self.M2_SendData(0x3F)	# VDH=15V
-        self.M2_SendData(0x3F)  # VDL=-15V
-        self.M2_SendData(0x0d)
+        self.M2_SendBuffer(bytes([0x07, 0x17, 0x3F, 0x3F, 0x0d]))
         
         # booster soft start
         self.M1_SendCommand(0x06)
-        self.M1_SendData(0x17)	#A
-        self.M1_SendData(0x17)	#B
-        self.M1_SendData(0x39)	#C
-        self.M1_SendData(0x17)
+        self.M1_SendBuffer(bytes([0x17, 0x17, 0x39, 0x17]))	#A, B, C
         self.M2_SendCommand(0x06)
-        self.M2_SendData(0x17)
-        self.M2_SendData(0x17)
-        self.M2_SendData(0x39)
-        self.M2_SendData(0x17)
+        self.M2_SendBuffer(bytes([0x17, 0x17, 0x39, 0x17]))
 
         #resolution setting
         self.M1_SendCommand(0x61)
-        self.M1_SendData(0x02)
-        self.M1_SendData(0x88)	#source 648
-        self.M1_SendData(0x01)	#gate 492
-        self.M1_SendData(0xEC)
+        self.M1_SendBuffer(bytes([0x02, 0x88, 0x01, 0xEC]))	#source 648, gate 492
         self.S1_SendCommand(0x61)
-        self.S1_SendData(0x02)
-        self.S1_SendData(0x90)	#source 656
-        self.S1_SendData(0x01)	#gate 492
-        self.S1_SendData(0xEC)
+        self.S1_SendBuffer(bytes([0x02, 0x90, 0x01, 0xEC]))	#source 656, gate 492
         self.M2_SendCommand(0x61)
-        self.M2_SendData(0x02)
-        self.M2_SendData(0x90)	#source 656
-        self.M2_SendData(0x01)	#gate 492
-        self.M2_SendData(0xEC)
+        self.M2_SendBuffer(bytes([0x02, 0x90, 0x01, 0xEC]))	#source 656, gate 492
         self.S2_SendCommand(0x61)
-        self.S2_SendData(0x02)
-        self.S2_SendData(0x88)	#source 648
-        self.S2_SendData(0x01)	#gate 492
-        self.S2_SendData(0xEC)
+        self.S2_SendBuffer(bytes([0x02, 0x88, 0x01, 0xEC]))	#source 648, gate 492
 
         self.M1S1M2S2_SendCommand(0x15)	#DUSPI
         self.M1S1M2S2_SendData(0x20)
@@ -128,8 +129,7 @@ class EPD(object):
         self.M1S1M2S2_SendData(0x08)
 
         self.M1S1M2S2_SendCommand(0x50)	#Vcom and data interval setting
-        self.M1S1M2S2_SendData(0x31)
-        self.M1S1M2S2_SendData(0x07)
+        self.M1S1M2S2_SendBuffer(bytes([0x31, 0x07]))
 
         self.M1S1M2S2_SendCommand(0x60)#TCON
         self.M1S1M2S2_SendData(0x22)
@@ -149,160 +149,250 @@ class EPD(object):
 
         self.SetLut()
         
-    def display(self, BlackImage, RedImage):
-        start = time.clock()
-        
-        Blackbuf = [0x00] * int(self.width * self.height / 8)
-        blackconvert = BlackImage.convert('1')       
-        bimwidth, bimheight = blackconvert.size 
-        Blackpixles = blackconvert.load()
-        temp=0;
-        for y in range(0, bimheight):
-            for x in range(0, bimwidth):
-                if Blackpixles[x, y] < 127:           # black
-                    Blackbuf[int((x + y*self.width)/8)] &= ~(0x80>>temp)
-                else:                           # white
-                    Blackbuf[int((x + y*self.width)/8)] |= (0x80>>temp)
-                temp=temp+1
-                if(temp==8):
-                    temp=0
-                    
-        Redbuf = [0x00] * int(self.width * self.height / 8)
-        redconvert = RedImage.convert('1')
-        rimwidth, rimheight = redconvert.size 
-        Redpixles = redconvert.load()
-        temp=0;
-        for y in range(0, rimheight):
-            for x in range(0, rimwidth):
-                if Redpixles[x, y] < 127:           # black
-                    Redbuf[int((x + y*self.width)/8)] &= ~(0x80>>temp)
-                else:                           # white
-                    Redbuf[int((x + y*self.width)/8)] |= (0x80>>temp)
-                temp=temp+1
-                if(temp==8):
-                    temp=0
-                    
-        #S2 part 648*492
-        self.S2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(Blackbuf[y*163 + x])
-        self.S2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(~Redbuf[y*163 + x])
-                
-        #M2 part 656*492
-        self.M2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(Blackbuf[y*163 + x])
-        self.M2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(~Redbuf[y*163 + x])
+    def display(self, Blackbuf, Redbuf, wait=True, Previous=None):
+        # Blackbuf and Redbuf are 1bpp planes packed MSB first, 163 bytes per row.
+        # Black plane bits are set for white pixels, red plane bits are set for red pixels.
+        # Previous is (Blackbuf, Redbuf) currently shown on the panel, halves that didn't change
+        # are neither uploaded nor refreshed.
+        # Returns Refresh handle, with wait=False call its wait() before sending anything else to the panel.
+        if len(Blackbuf) != self.buffer_size or len(Redbuf) != self.buffer_size:
+            raise ValueError("Expected %d bytes per plane" % self.buffer_size)
+        self.PartialOut()
+        start = time.perf_counter()
 
-        #M1 part 648*492    
-        self.M1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(Blackbuf[y*163 + x])
-        self.M1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(~Redbuf[y*163 + x])
-        
-        #S1 part 656*492
-        self.S1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(Blackbuf[y*163 + x])
-        self.S1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(~Redbuf[y*163 + x])
-                
-        end = time.clock()
+        top = self.HalfChanged(Blackbuf, Redbuf, Previous, TOP_HALF)
+        bottom = self.HalfChanged(Blackbuf, Redbuf, Previous, BOTTOM_HALF)
+
+        if top:
+            #S2 part 648*492
+            self.S2_SendCommand(0x10)
+            self.S2_SendBuffer(self.GetPart(Blackbuf, S2_PART))
+            self.S2_SendCommand(0x13)
+            self.S2_SendBuffer(self.GetPart(Redbuf, S2_PART))
+
+            #M2 part 656*492
+            self.M2_SendCommand(0x10)
+            self.M2_SendBuffer(self.GetPart(Blackbuf, M2_PART))
+            self.M2_SendCommand(0x13)
+            self.M2_SendBuffer(self.GetPart(Redbuf, M2_PART))
+
+        if bottom:
+            #M1 part 648*492
+            self.M1_SendCommand(0x10)
+            self.M1_SendBuffer(self.GetPart(Blackbuf, M1_PART))
+            self.M1_SendCommand(0x13)
+            self.M1_SendBuffer(self.GetPart(Redbuf, M1_PART))
+
+            #S1 part 656*492
+            self.S1_SendCommand(0x10)
+            self.S1_SendBuffer(self.GetPart(Blackbuf, S1_PART))
+            self.S1_SendCommand(0x13)
+            self.S1_SendBuffer(self.GetPart(Redbuf, S1_PART))
+
+        end = time.perf_counter()
         print("use time: %f"%(end - start))
-        self.TurnOnDisplay()
+        return self.TurnOnDisplay(wait, top, bottom)
+
+    def display_partial(self, Blackbuf, Redbuf, Rects, wait=True):
+        # Uploads and refreshes only windows around Rects, boxes (left, top, right, bottom) in panel pixels
+        # that have to cover everything that changed. Each controller gets one window around all its rects,
+        # controllers without any are left alone.
+        if len(Blackbuf) != self.buffer_size or len(Redbuf) != self.buffer_size:
+            raise ValueError("Expected %d bytes per plane" % self.buffer_size)
+        self.PartialOut()
+        start = time.perf_counter()
+
+        controllers = []
+        for name in CONTROLLERS:
+            part, send_command, send_buffer, busy_pin = self.GetController(name)
+            window = self.GetWindow(part, Rects)
+            if window is None:
+                continue
+            send_command(0x91)	#partial in
+            send_command(0x90)	#partial window
+            send_buffer(self.GetWindowSetting(part, window))
+            send_command(0x10)
+            send_buffer(self.GetPart(Blackbuf, window))
+            send_command(0x13)
+            send_buffer(self.GetPart(Redbuf, window))
+            controllers.append(name)
+        self.partial = set(controllers)
+
+        end = time.perf_counter()
+        print("use time: %f"%(end - start))
+        return self.TurnOnControllers(controllers, wait)
+
+    def PartialOut(self):
+        # Controllers stay in partial mode until told otherwise
+        for name in self.partial:
+            self.GetController(name)[1](0x92)
+        self.partial = set()
+
+    def GetWindow(self, part, Rects):
+        # Byte aligned bounding box of rects within controller's part, in the same form as parts
+        (first_row, last_row), (first_column, last_column) = part
+        rows, columns = [], []
+        for left, top, right, bottom in Rects:
+            top, bottom = max(top, first_row), min(bottom, last_row)
+            left, right = max(left // 8, first_column), min((right + 7) // 8, last_column)
+            if top < bottom and left < right:
+                rows += [top, bottom]
+                columns += [left, right]
+        if not rows:
+            return None
+        return (min(rows), max(rows)), (min(columns), max(columns))
+
+    def GetWindowSetting(self, part, window):
+        # Partial window command parameters, coordinates are relative to controller's part
+        (first_row, _), (first_column, _) = part
+        (top, bottom), (left, right) = window
+        hrst = (left - first_column) * 8
+        hred = (right - first_column) * 8 - 1
+        vrst = top - first_row
+        vred = bottom - first_row - 1
+        return bytes([
+            hrst >> 8, hrst & 0xf8,
+            hred >> 8, hred & 0xff,
+            vrst >> 8, vrst & 0xff,
+            vred >> 8, vred & 0xff,
+            0x01,	#PT_SCAN, gates scan inside and outside of the window
+        ])
+
+    def GetDirtyRects(self, Blackbuf, Redbuf, Previous):
+        # Bounding box of changes within each controller's part, boxes are (left, top, right, bottom) in pixels
+        rects = []
+        PreviousBlack, PreviousRed = Previous
+        for name in CONTROLLERS:
+            (first_row, last_row), (first_column, last_column) = self.GetController(name)[0]
+            width = last_column - first_column
+            rows, columns = [], []
+            for y in range(first_row, last_row):
+                first, last = y*EPD_ROW_BYTES + first_column, y*EPD_ROW_BYTES + last_column
+                changed = (
+                    (int.from_bytes(Blackbuf[first:last], "big") ^ int.from_bytes(PreviousBlack[first:last], "big"))
+                    | (int.from_bytes(Redbuf[first:last], "big") ^ int.from_bytes(PreviousRed[first:last], "big"))
+                )
+                if changed:
+                    rows.append(y)
+                    # Lowest set bit belongs to the last changed byte, highest to the first one
+                    columns.append(first_column + width - (changed.bit_length() + 7) // 8)
+                    columns.append(first_column + width - ((changed & -changed).bit_length() - 1) // 8)
+            if rows:
+                rects.append((min(columns) * 8, min(rows), max(columns) * 8, max(rows) + 1))
+        return rects
+
+    def HalfChanged(self, Blackbuf, Redbuf, Previous, half):
+        # Halves are whole rows, so each one is a contiguous range of both planes
+        if Previous is None:
+            return True
+        first, last = half[0][0] * EPD_ROW_BYTES, half[0][1] * EPD_ROW_BYTES
+        PreviousBlack, PreviousRed = Previous
+        return (memoryview(Blackbuf)[first:last] != memoryview(PreviousBlack)[first:last]
+                or memoryview(Redbuf)[first:last] != memoryview(PreviousRed)[first:last])
 
     def clear(self):
         """Clear contents of image buffer"""
-        start = time.clock()
+        start = time.perf_counter()
+        
+        white = WHITE_BUFFER
+        no_red = NO_RED_BUFFER
         
         self.S2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(0xff)        
+        self.S2_SendBuffer(self.GetPart(white, S2_PART))
         self.S2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(0x00)
+        self.S2_SendBuffer(self.GetPart(no_red, S2_PART))
                 
         self.M2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(0xff)
+        self.M2_SendBuffer(self.GetPart(white, M2_PART))
         self.M2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(0x00)       
+        self.M2_SendBuffer(self.GetPart(no_red, M2_PART))
                     
         self.M1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(0xff)
+        self.M1_SendBuffer(self.GetPart(white, M1_PART))
         self.M1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(0x00)
+        self.M1_SendBuffer(self.GetPart(no_red, M1_PART))
                 
         self.S1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(0xff)
+        self.S1_SendBuffer(self.GetPart(white, S1_PART))
         self.S1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(0x00)
+        self.S1_SendBuffer(self.GetPart(no_red, S1_PART))
                 
-        end = time.clock()
+        end = time.perf_counter()
         print (end)
         print (start)
         print("use time: %f" %(end - start))
         
         self.TurnOnDisplay()
         
+    def GetPart(self, buf, part):
+        # Cuts controller's part out of a full frame buffer, row by row
+        (first_row, last_row), (first_column, last_column) = part
+        view = memoryview(buf)
+        return b"".join(
+            view[y*EPD_ROW_BYTES + first_column:y*EPD_ROW_BYTES + last_column]
+            for y in range(first_row, last_row)
+        )
+
     def Reset(self):
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 1) 
         epdconfig.digital_write(self.EPD_M2S2_RST_PIN, 1) 
-        time.sleep(0.2) 
+        epdconfig.delay_ms(200) 
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 0) 
         epdconfig.digital_write(self.EPD_M2S2_RST_PIN, 0) 
-        time.sleep(0.01) 
+        epdconfig.delay_ms(10) 
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 1) 
         epdconfig.digital_write(self.EPD_M2S2_RST_PIN, 1) 
-        time.sleep(0.2) 
+        epdconfig.delay_ms(200) 
     
     def EPD_Sleep(self):
+        self.PartialOut()
         self.M1S1M2S2_SendCommand(0X02)   	
-        time.sleep(0.3) 
+        epdconfig.delay_ms(300) 
 
         self.M1S1M2S2_SendCommand(0X07)   	
         self.M1S1M2S2_SendData(0xA5) 
-        time.sleep(0.3) 
+        epdconfig.delay_ms(300) 
         print("module_exit")
         epdconfig.module_exit()
 
-    def TurnOnDisplay(self):
-        self.M1M2_SendCommand(0x04)  
-        time.sleep(0.3) 
-        self.M1S1M2S2_SendCommand(0x12) 
-        self.M1_ReadBusy()
-        self.S1_ReadBusy()
-        self.M2_ReadBusy()
-        self.S2_ReadBusy()   
-        
+    def TurnOnDisplay(self, wait=True, Top=True, Bottom=True):
+        controllers = []
+        if Top:
+            controllers += ["M2", "S2"]
+        if Bottom:
+            controllers += ["M1", "S1"]
+        return self.TurnOnControllers(controllers, wait)
+
+    def TurnOnControllers(self, controllers, wait=True):
+        # Refreshes given controllers, cascaded pairs get the refresh command at the same time
+        controllers = set(controllers)
+        if controllers:
+            self.M1M2_SendCommand(0x04)  
+            epdconfig.delay_ms(300) 
+        if controllers == {"M1", "S1", "M2", "S2"}:
+            self.M1S1M2S2_SendCommand(0x12) 
+        else:
+            for master, slave, send_pair_command in (("M2", "S2", self.M2S2_SendCommand), ("M1", "S1", self.M1S1_SendCommand)):
+                if master in controllers and slave in controllers:
+                    send_pair_command(0x12)
+                elif master in controllers or slave in controllers:
+                    self.GetController(master if master in controllers else slave)[1](0x12)
+        refresh = Refresh(dict(
+            (self.GetController(name)[3], self.GetController(name)[1]) for name in controllers
+        ))
+        if wait:
+            refresh.wait()
+        return refresh
+
+    def GetController(self, name):
+        # Returns (part, SendCommand, SendBuffer, BUSY pin) of controller
+        return {
+            "S2": (S2_PART, self.S2_SendCommand, self.S2_SendBuffer, self.EPD_S2_BUSY_PIN),
+            "M2": (M2_PART, self.M2_SendCommand, self.M2_SendBuffer, self.EPD_M2_BUSY_PIN),
+            "M1": (M1_PART, self.M1_SendCommand, self.M1_SendBuffer, self.EPD_M1_BUSY_PIN),
+            "S1": (S1_PART, self.S1_SendCommand, self.S1_SendBuffer, self.EPD_S1_BUSY_PIN),
+        }[name]
+
     """   M1S1M2S2 Write register address and data     """
     def M1S1M2S2_SendCommand(self, cmd):
         epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 0)
@@ -332,6 +422,26 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
 
+    def M1S1M2S2_SendBuffer(self, buf):
+        self.SendBuffer((self.EPD_M1_CS_PIN, self.EPD_S1_CS_PIN, self.EPD_M2_CS_PIN, self.EPD_S2_CS_PIN),
+                        (self.EPD_M1S1_DC_PIN, self.EPD_M2S2_DC_PIN), buf)
+
+    """   M1S1 and M2S2 pairs Write register address     """
+    def M1S1_SendCommand(self, cmd):
+        epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 0)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
+        epdconfig.spi_writebyte(cmd)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
+    def M2S2_SendCommand(self, cmd):
+        epdconfig.digital_write(self.EPD_M2S2_DC_PIN, 0)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
+        epdconfig.spi_writebyte(cmd)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
+
     """   M1M2 Write register address and data     """
     def M1M2_SendCommand(self, cmd):
         epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 0)
@@ -362,6 +472,8 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
+    def S2_SendBuffer(self, buf):
+        self.SendBuffer((self.EPD_S2_CS_PIN,), (self.EPD_M2S2_DC_PIN,), buf)
         
     """   M2 Write register address and data     """
     def M2_SendCommand(self, cmd):
@@ -374,6 +486,8 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
         epdconfig.spi_writebyte(val) 
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
+    def M2_SendBuffer(self, buf):
+        self.SendBuffer((self.EPD_M2_CS_PIN,), (self.EPD_M2S2_DC_PIN,), buf)
 
     """   S1 Write register address and data     """
     def S1_SendCommand(self, cmd):
@@ -386,6 +500,8 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
+    def S1_SendBuffer(self, buf):
+        self.SendBuffer((self.EPD_S1_CS_PIN,), (self.EPD_M1S1_DC_PIN,), buf)
         
     """   M1 Write register address and data     """
     def M1_SendCommand(self, cmd):
@@ -398,6 +514,18 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
+    def M1_SendBuffer(self, buf):
+        self.SendBuffer((self.EPD_M1_CS_PIN,), (self.EPD_M1S1_DC_PIN,), buf)
+
+    """   Write data block with CS held low for the whole buffer     """
+    def SendBuffer(self, cs_pins, dc_pins, buf):
+        for pin in dc_pins:
+            epdconfig.digital_write(pin, 1)
+        for pin in cs_pins:
+            epdconfig.digital_write(pin, 0)
+        epdconfig.spi_writebytes(buf)
+        for pin in cs_pins:
+            epdconfig.digital_write(pin, 1)
 
     #Busy
     def M1_ReadBusy(self):
@@ -408,7 +536,7 @@ class EPD(object):
             self.M1_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_M1_BUSY_PIN) 
             busy = not(busy & 0x01) 
-        time.sleep(0.2)
+        epdconfig.delay_ms(200)
     def M2_ReadBusy(self):
         self.M2_SendCommand(0x71) 
         busy = epdconfig.digital_read(self.EPD_M2_BUSY_PIN) 
@@ -418,7 +546,7 @@ class EPD(object):
             self.M2_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_M2_BUSY_PIN) 
             busy =not(busy & 0x01) 
-        time.sleep(0.2)
+        epdconfig.delay_ms(200)
     def S1_ReadBusy(self):
         self.S1_SendCommand(0x71) 
         busy = epdconfig.digital_read(self.EPD_S1_BUSY_PIN) 
@@ -427,7 +555,7 @@ class EPD(object):
             self.S1_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_S1_BUSY_PIN) 
             busy = not(busy & 0x01) 
-        time.sleep(0.2)        
+        epdconfig.delay_ms(200)        
     def S2_ReadBusy(self):
         self.S2_SendCommand(0x71) 
         busy = epdconfig.digital_read(self.EPD_S2_BUSY_PIN) 
@@ -436,7 +564,7 @@ class EPD(object):
             self.S2_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_S2_BUSY_PIN) 
             busy = not(busy & 0x01) 
-        time.sleep(0.2)            
+        epdconfig.delay_ms(200)            
 
     lut_vcom1 = [
         0x00,	0x10,	0x10,	0x01,	0x08,	0x01,
@@ -501,25 +629,69 @@ class EPD(object):
     
     def SetLut(self):
         self.M1S1M2S2_SendCommand(0x20) #vcom
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_vcom1[count])
+        self.M1S1M2S2_SendBuffer(bytes(self.lut_vcom1))
 
         self.M1S1M2S2_SendCommand(0x21) #red not use
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_ww1[count])
+        self.M1S1M2S2_SendBuffer(bytes(self.lut_ww1))
 
         self.M1S1M2S2_SendCommand(0x22) #bw r
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_bw1[count])   # bw=r
+        self.M1S1M2S2_SendBuffer(bytes(self.lut_bw1))   # bw=r
 
         self.M1S1M2S2_SendCommand(0x23) #wb w
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_wb1[count])   # wb=w
+        self.M1S1M2S2_SendBuffer(bytes(self.lut_wb1))   # wb=w
 
         self.M1S1M2S2_SendCommand(0x24) #bb b
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_bb1[count])   # bb=b
+        self.M1S1M2S2_SendBuffer(bytes(self.lut_bb1))   # bb=b
             
         self.M1S1M2S2_SendCommand(0x25) #bb b
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_ww1[count])   # bb=b
+        self.M1S1M2S2_SendBuffer(bytes(self.lut_ww1))   # bb=b
+
+
+class Refresh(object):
+    # Panel refresh started by TurnOnDisplay, BUSY pins go high once controllers are idle again.
+    # Edges are caught by GPIO interrupts on all refreshed controllers at once, so nothing spins while the panel works.
+    def __init__(self, controllers):
+        # controllers maps BUSY pin to the function sending commands to its controller
+        self.pins = tuple(controllers)
+        self.pending = dict(controllers)
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.finished = False
+        if not self.pending:
+            self.idle.set()
+        for pin in self.pins:
+            epdconfig.add_rising_edge_callback(pin, self.OnIdle)
+
+    def OnIdle(self, pin):
+        with self.lock:
+            self.pending.pop(pin, None)
+            if not self.pending:
+                self.idle.set()
+
+    def wait(self, timeout=None):
+        # Blocks until all controllers finished refreshing, returns False on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.finished:
+            interval = BUSY_POLL_INTERVAL
+            if deadline is not None:
+                interval = min(interval, deadline - time.monotonic())
+                if interval <= 0:
+                    return False
+            if not self.idle.wait(interval):
+                self.Poll()
+                continue
+            for pin in self.pins:
+                epdconfig.remove_edge_callback(pin)
+            if self.pins:
+                epdconfig.delay_ms(200)
+            self.finished = True
+        return True
+
+    def Poll(self):
+        # Fallback for missed edges, same status check ReadBusy does
+        with self.lock:
+            pending = list(self.pending.items())
+        for pin, send_command in pending:
+            send_command(0x71)
+            if epdconfig.digital_read(pin) & 0x01:
+                self.OnIdle(pin)
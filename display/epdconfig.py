@@ -26,7 +26,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
-import RPi.GPIO as GPIO
 import time
 import os
 import logging
@@ -53,101 +52,178 @@ EPD_S1_BUSY_PIN  =19
 EPD_M2_BUSY_PIN  =27
 EPD_S2_BUSY_PIN  =24
 
-find_dirs = [
-    os.path.dirname(os.path.realpath(__file__)),
-    '/usr/local/lib',
-    '/usr/lib',
-]
-spi = None
-for find_dir in find_dirs:
-    val = int(os.popen('getconf LONG_BIT').read())
-    logging.debug("System is %d bit"%val)
-    if val == 64:
-        so_filename = os.path.join(find_dir, 'DEV_Config_64.so')
-    else:
-        so_filename = os.path.join(find_dir, 'DEV_Config_32.so')
-    if os.path.exists(so_filename):
-        spi = CDLL(so_filename)
-        break
-if spi is None:
-    RuntimeError('Cannot find DEV_Config.so')
-
-
-def digital_write(pin, value):
-    GPIO.output(pin, value)
-
-def digital_read(pin):
-    return GPIO.input(pin)
-
-def spi_writebyte(value): 
-    spi.DEV_SPI_WriteByte(value)
- 
-def delay_ms(delaytime):
-    time.sleep(delaytime / 1000.0)
+SPIDEV_BUS       =0
+SPIDEV_DEVICE    =0
+SPIDEV_SPEED_HZ  =4000000
+SPIDEV_BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+
+# Set to "simulator" to run the driver without a panel, see display/epdsim.py
+BACKEND_ENV = 'MAGINKCAL_EPD'
+
+
+class RaspberryPi:
+    def __init__(self):
+        import RPi.GPIO
+        self.GPIO = RPi.GPIO
+
+        try:
+            import spidev
+        except ImportError:
+            spidev = None
+        self._spidev = spidev
+
+        find_dirs = [
+            os.path.dirname(os.path.realpath(__file__)),
+            '/usr/local/lib',
+            '/usr/lib',
+        ]
+        self._spi = None
+        for find_dir in find_dirs:
+            val = int(os.popen('getconf LONG_BIT').read())
+            logging.debug("System is %d bit"%val)
+            if val == 64:
+                so_filename = os.path.join(find_dir, 'DEV_Config_64.so')
+            else:
+                so_filename = os.path.join(find_dir, 'DEV_Config_32.so')
+            if os.path.exists(so_filename):
+                self._spi = CDLL(so_filename)
+                break
+        if self._spi is None:
+            RuntimeError('Cannot find DEV_Config.so')
+
+        # Hardware SPI through spidev is used when available, CS lines stay driven by GPIO (no_cs),
+        # otherwise bytes are written through DEV_Config.so
+        self._use_spidev = spidev is not None and os.path.exists('/dev/spidev%d.%d' % (SPIDEV_BUS, SPIDEV_DEVICE))
+        self._spidev_device = None
+        self._spi_chunk_size = 4096
+
+    def digital_write(self, pin, value):
+        self.GPIO.output(pin, value)
+
+    def digital_read(self, pin):
+        return self.GPIO.input(pin)
+
+    def add_rising_edge_callback(self, pin, callback):
+        # Callback is run from RPi.GPIO thread with pin number as the only argument
+        self.GPIO.add_event_detect(pin, self.GPIO.RISING, callback=callback)
+
+    def remove_edge_callback(self, pin):
+        self.GPIO.remove_event_detect(pin)
+
+    def spi_writebyte(self, value):
+        if self._spidev_device is not None:
+            self._spidev_device.writebytes([value & 0xff])
+        else:
+            self._spi.DEV_SPI_WriteByte(value)
+
+    def spi_writebytes(self, data):
+        # Streams whole buffer, CS and DC have to be set by the caller once for the whole block
+        if self._spidev_device is not None:
+            view = memoryview(data)
+            for offset in range(0, len(view), self._spi_chunk_size):
+                self._spidev_device.writebytes2(view[offset:offset + self._spi_chunk_size])
+        elif hasattr(self._spi, 'DEV_SPI_Write_nByte'):
+            buf = bytes(data)
+            self._spi.DEV_SPI_Write_nByte(c_char_p(buf), c_uint32(len(buf)))
+        else:
+            for value in data:
+                self._spi.DEV_SPI_WriteByte(value)
+
+    def _get_spi_chunk_size(self):
+        # Kernel refuses transfers bigger than spidev buffer size
+        try:
+            with open(SPIDEV_BUFSIZ_PATH) as bufsiz:
+                return int(bufsiz.read())
+        except (OSError, ValueError):
+            return 4096
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime / 1000.0)
+
+    def module_init(self):
+        GPIO = self.GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        if not self._use_spidev:
+            GPIO.setup(EPD_SCK_PIN, GPIO.OUT)    
+            GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
+        
+        logging.debug("python call bcm2835 Lib")
         
-def module_init():
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setwarnings(False)
-    GPIO.setup(EPD_SCK_PIN, GPIO.OUT)    
-    GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
-    
-    logging.debug("python call bcm2835 Lib")
-    
-    GPIO.setup(EPD_M2S2_RST_PIN, GPIO.OUT)    
-    GPIO.setup(EPD_M1S1_RST_PIN, GPIO.OUT)
-    GPIO.setup(EPD_M2S2_DC_PIN, GPIO.OUT)
-    GPIO.setup(EPD_M1S1_DC_PIN, GPIO.OUT)
-    GPIO.setup(EPD_S1_CS_PIN, GPIO.OUT)
-    GPIO.setup(EPD_S2_CS_PIN, GPIO.OUT)
-    GPIO.setup(EPD_M1_CS_PIN, GPIO.OUT)
-    GPIO.setup(EPD_M2_CS_PIN, GPIO.OUT)
-
-    GPIO.setup(EPD_S1_BUSY_PIN, GPIO.IN)
-    GPIO.setup(EPD_S2_BUSY_PIN, GPIO.IN)
-    GPIO.setup(EPD_M1_BUSY_PIN, GPIO.IN)
-    GPIO.setup(EPD_M2_BUSY_PIN, GPIO.IN)
-    
-    digital_write(EPD_M1_CS_PIN, 1)
-    digital_write(EPD_S1_CS_PIN, 1)
-    digital_write(EPD_M2_CS_PIN, 1)
-    digital_write(EPD_S2_CS_PIN, 1)
-    
-    digital_write(EPD_M2S2_RST_PIN, 0)
-    digital_write(EPD_M1S1_RST_PIN, 0)
-    digital_write(EPD_M2S2_DC_PIN, 1)
-    digital_write(EPD_M1S1_DC_PIN, 1)
-
-    spi.DEV_ModuleInit()
-
-def module_exit():
-    digital_write(EPD_M2S2_RST_PIN, 0)
-    digital_write(EPD_M1S1_RST_PIN, 0)
-    digital_write(EPD_M2S2_DC_PIN, 0)
-    digital_write(EPD_M1S1_DC_PIN, 0)
-    digital_write(EPD_S1_CS_PIN, 1)
-    digital_write(EPD_S2_CS_PIN, 1)
-    digital_write(EPD_M1_CS_PIN, 1)
-    digital_write(EPD_M2_CS_PIN, 1)
-
-def spi_readbyte(Reg):
-    GPIO.setup(EPD_MOSI_PIN, GPIO.IN)
-    j=0
-    # time.sleep(0.01)
-    for i in range(0, 8):
-        GPIO.output(EPD_SCK_PIN, GPIO.LOW) 
-        # time.sleep(0.01) 
-        j = j << 1 
-        if(GPIO.input(EPD_MOSI_PIN) == GPIO.HIGH):
-            j |= 0x01
+        GPIO.setup(EPD_M2S2_RST_PIN, GPIO.OUT)    
+        GPIO.setup(EPD_M1S1_RST_PIN, GPIO.OUT)
+        GPIO.setup(EPD_M2S2_DC_PIN, GPIO.OUT)
+        GPIO.setup(EPD_M1S1_DC_PIN, GPIO.OUT)
+        GPIO.setup(EPD_S1_CS_PIN, GPIO.OUT)
+        GPIO.setup(EPD_S2_CS_PIN, GPIO.OUT)
+        GPIO.setup(EPD_M1_CS_PIN, GPIO.OUT)
+        GPIO.setup(EPD_M2_CS_PIN, GPIO.OUT)
+
+        GPIO.setup(EPD_S1_BUSY_PIN, GPIO.IN)
+        GPIO.setup(EPD_S2_BUSY_PIN, GPIO.IN)
+        GPIO.setup(EPD_M1_BUSY_PIN, GPIO.IN)
+        GPIO.setup(EPD_M2_BUSY_PIN, GPIO.IN)
+        
+        self.digital_write(EPD_M1_CS_PIN, 1)
+        self.digital_write(EPD_S1_CS_PIN, 1)
+        self.digital_write(EPD_M2_CS_PIN, 1)
+        self.digital_write(EPD_S2_CS_PIN, 1)
+        
+        self.digital_write(EPD_M2S2_RST_PIN, 0)
+        self.digital_write(EPD_M1S1_RST_PIN, 0)
+        self.digital_write(EPD_M2S2_DC_PIN, 1)
+        self.digital_write(EPD_M1S1_DC_PIN, 1)
+
+        if self._use_spidev:
+            self._spidev_device = self._spidev.SpiDev()
+            self._spidev_device.open(SPIDEV_BUS, SPIDEV_DEVICE)
+            self._spidev_device.max_speed_hz = SPIDEV_SPEED_HZ
+            self._spidev_device.mode = 0b00
+            self._spidev_device.no_cs = True
+            self._spi_chunk_size = self._get_spi_chunk_size()
+            logging.debug("SPI through spidev, %d bytes per transfer" % self._spi_chunk_size)
         else:
-            j &= 0xfe 
+            self._spi.DEV_ModuleInit()
+
+    def module_exit(self):
+        if self._spidev_device is not None:
+            self._spidev_device.close()
+            self._spidev_device = None
+        self.digital_write(EPD_M2S2_RST_PIN, 0)
+        self.digital_write(EPD_M1S1_RST_PIN, 0)
+        self.digital_write(EPD_M2S2_DC_PIN, 0)
+        self.digital_write(EPD_M1S1_DC_PIN, 0)
+        self.digital_write(EPD_S1_CS_PIN, 1)
+        self.digital_write(EPD_S2_CS_PIN, 1)
+        self.digital_write(EPD_M1_CS_PIN, 1)
+        self.digital_write(EPD_M2_CS_PIN, 1)
+
+    def spi_readbyte(self, Reg):
+        GPIO = self.GPIO
+        GPIO.setup(EPD_MOSI_PIN, GPIO.IN)
+        j=0
         # time.sleep(0.01)
-        GPIO.output(EPD_SCK_PIN, GPIO.HIGH) 
-        # time.sleep(0.01)  
-    GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
-    return j 
-    
-def delay_ms(delaytime):
-    time.sleep(delaytime / 1000.0)
-
-  
\ No newline at end of file
+        for i in range(0, 8):
+            GPIO.output(EPD_SCK_PIN, GPIO.LOW) 
+            # time.sleep(0.01) 
+            j = j << 1 
+            if(GPIO.input(EPD_MOSI_PIN) == GPIO.HIGH):
+                j |= 0x01
+            else:
+                j &= 0xfe 
+            # time.sleep(0.01)
+            GPIO.output(EPD_SCK_PIN, GPIO.HIGH) 
+            # time.sleep(0.01)  
+        GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
+        return j 
+
+
+if os.environ.get(BACKEND_ENV) == 'simulator':
+    from display.epdsim import Simulator
+    implementation = Simulator()
+else:
+    implementation = RaspberryPi()
+
+for func in [x for x in dir(implementation) if not x.startswith('_')]:
+    setattr(sys.modules[__name__], func, getattr(implementation, func))
+
@@ -0,0 +1,260 @@
+import logging
+import threading
+
+
+# Rough costs on Raspberry Pi Zero, all in seconds
+GPIO_WRITE_COST = 0.000005
+GPIO_READ_COST = 0.000005
+SPI_CALL_COST = 0.00005
+# Full refresh of 12.48" B panel, BUSY stays low for this long after 0x12
+REFRESH_TIME = 16.0
+
+# UC8179 commands the simulator understands
+DATA_START_TRANSMISSION_1 = 0x10
+DATA_START_TRANSMISSION_2 = 0x13
+DISPLAY_REFRESH = 0x12
+PARTIAL_WINDOW = 0x90
+PARTIAL_IN = 0x91
+PARTIAL_OUT = 0x92
+GET_STATUS = 0x71
+DEEP_SLEEP = 0x07
+DEEP_SLEEP_CHECK = 0xA5
+
+
+class Controller:
+    # State of one of the four UC8179 controllers, SRAM is lost on reset but the panel keeps its image
+    def __init__(self, name, cs_pin, dc_pin, rst_pin, busy_pin, part):
+        self.name = name
+        self.cs_pin = cs_pin
+        self.dc_pin = dc_pin
+        self.rst_pin = rst_pin
+        self.busy_pin = busy_pin
+        self.part = part
+        self.displayed = None
+        self.refreshes = 0
+        self.busy_until = None
+        self.reset()
+
+    def reset(self):
+        self.command = None
+        self.registers = {}
+        self.asleep = False
+        self.partial = False
+
+    def receive(self, is_data, data):
+        if self.asleep:
+            return
+        if not is_data:
+            for command in data:
+                self.command = command
+                self.registers[command] = bytearray()
+                if command in (PARTIAL_IN, PARTIAL_OUT):
+                    self.partial = command == PARTIAL_IN
+            return
+        if self.command is None:
+            return
+        self.registers[self.command] += data
+        if self.command == DEEP_SLEEP and self.registers[DEEP_SLEEP] == bytes([DEEP_SLEEP_CHECK]):
+            self.asleep = True
+
+
+class Simulator:
+    # Drop-in replacement for epdconfig.RaspberryPi, records bus traffic, rebuilds controller framebuffers
+    # and estimates how long the same calls would take on the device
+
+    def __init__(self, spi_clock_hz=None, gpio_write_cost=GPIO_WRITE_COST, gpio_read_cost=GPIO_READ_COST,
+                 spi_call_cost=SPI_CALL_COST, refresh_time=REFRESH_TIME, spi_chunk_size=4096, record=True):
+        from display import epdconfig
+
+        self.logger = logging.getLogger('epdsim')
+        self.spi_clock_hz = spi_clock_hz or epdconfig.SPIDEV_SPEED_HZ
+        self.gpio_write_cost = gpio_write_cost
+        self.gpio_read_cost = gpio_read_cost
+        self.spi_call_cost = spi_call_cost
+        self.refresh_time = refresh_time
+        self.spi_chunk_size = spi_chunk_size
+        self.record = record
+        self.controllers = (
+            Controller("M1", epdconfig.EPD_M1_CS_PIN, epdconfig.EPD_M1S1_DC_PIN, epdconfig.EPD_M1S1_RST_PIN,
+                       epdconfig.EPD_M1_BUSY_PIN, "M1_PART"),
+            Controller("S1", epdconfig.EPD_S1_CS_PIN, epdconfig.EPD_M1S1_DC_PIN, epdconfig.EPD_M1S1_RST_PIN,
+                       epdconfig.EPD_S1_BUSY_PIN, "S1_PART"),
+            Controller("M2", epdconfig.EPD_M2_CS_PIN, epdconfig.EPD_M2S2_DC_PIN, epdconfig.EPD_M2S2_RST_PIN,
+                       epdconfig.EPD_M2_BUSY_PIN, "M2_PART"),
+            Controller("S2", epdconfig.EPD_S2_CS_PIN, epdconfig.EPD_M2S2_DC_PIN, epdconfig.EPD_M2S2_RST_PIN,
+                       epdconfig.EPD_S2_BUSY_PIN, "S2_PART"),
+        )
+        self.lock = threading.Lock()
+        self.pins = {}
+        self.callbacks = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        # Starts new measurement, controller and pin state is kept
+        with self.lock:
+            self.elapsed = 0.0
+            self.log = []
+            self.stats = {
+                "gpio_writes": 0,
+                "gpio_reads": 0,
+                "spi_calls": 0,
+                "spi_bytes": 0,
+                "busy_polls": 0,
+                "refreshes": 0,
+                "delay": 0.0,
+            }
+
+    def get_report(self):
+        # Estimated device time next to bus counters, refreshes per controller
+        with self.lock:
+            report = dict(self.stats, elapsed=round(self.elapsed, 6))
+        report["controller_refreshes"] = {controller.name: controller.refreshes for controller in self.controllers}
+        return report
+
+    def get_frame(self):
+        # Rebuilds full black and red planes from what controllers refreshed last,
+        # parts never refreshed are white
+        import display.epd12in48b as eink
+
+        black = bytearray([0xff]) * (eink.EPD_ROW_BYTES * eink.EPD_HEIGHT)
+        red = bytearray(eink.EPD_ROW_BYTES * eink.EPD_HEIGHT)
+        for controller in self.controllers:
+            if controller.displayed is None:
+                continue
+            (first_row, last_row), (first_column, last_column) = getattr(eink, controller.part)
+            width = last_column - first_column
+            for plane, data in zip((black, red), controller.displayed):
+                for index, y in enumerate(range(first_row, last_row)):
+                    row = data[index * width:(index + 1) * width]
+                    plane[y * eink.EPD_ROW_BYTES + first_column:y * eink.EPD_ROW_BYTES + first_column + len(row)] = row
+        return bytes(black), bytes(red)
+
+    def digital_write(self, pin, value):
+        with self.lock:
+            self._spend(self.gpio_write_cost, "gpio_writes")
+            self._log("write", pin, value)
+            previous = self.pins.get(pin, 0)
+            self.pins[pin] = value
+        if previous and not value:
+            for controller in self.controllers:
+                if controller.rst_pin == pin:
+                    controller.reset()
+
+    def digital_read(self, pin):
+        with self.lock:
+            self._spend(self.gpio_read_cost, "gpio_reads")
+            self._log("read", pin)
+            for controller in self.controllers:
+                if controller.busy_pin == pin:
+                    # Reader is modelled as blocked until the refresh finishes
+                    self.stats["busy_polls"] += 1
+                    self._finish_refresh(controller)
+                    return 1
+            return self.pins.get(pin, 0)
+
+    def add_rising_edge_callback(self, pin, callback):
+        self.callbacks[pin] = callback
+        for controller in self.controllers:
+            if controller.busy_pin == pin and controller.busy_until is not None:
+                threading.Timer(0, self._fire_edge, (controller,)).start()
+
+    def remove_edge_callback(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def spi_writebyte(self, value):
+        self._transfer(bytes([value & 0xff]), 1)
+
+    def spi_writebytes(self, data):
+        data = bytes(data)
+        self._transfer(data, max(1, -(-len(data) // self.spi_chunk_size)))
+
+    def spi_readbyte(self, Reg):
+        return 0
+
+    def delay_ms(self, delaytime):
+        with self.lock:
+            self.elapsed += delaytime / 1000.0
+            self.stats["delay"] += delaytime / 1000.0
+            self._log("delay", delaytime)
+
+    def module_init(self):
+        self.logger.info("Simulated EPD initialized")
+        for controller in self.controllers:
+            self.pins[controller.cs_pin] = 1
+            self.pins[controller.dc_pin] = 1
+
+    def module_exit(self):
+        self.logger.info(f"Simulated EPD stopped: {self.get_report()}")
+
+    def _transfer(self, data, calls):
+        with self.lock:
+            self.stats["spi_calls"] += calls
+            self.stats["spi_bytes"] += len(data)
+            self.elapsed += calls * self.spi_call_cost + len(data) * 8 / self.spi_clock_hz
+            self._log("spi", data)
+            selected = [controller for controller in self.controllers if not self.pins.get(controller.cs_pin, 1)]
+            for controller in selected:
+                is_data = bool(self.pins.get(controller.dc_pin, 1))
+                controller.receive(is_data, data)
+                if is_data or controller.asleep:
+                    continue
+                if data[-1] == GET_STATUS:
+                    self.stats["busy_polls"] += 1
+                elif data[-1] == DISPLAY_REFRESH:
+                    self._start_refresh(controller)
+
+    def _start_refresh(self, controller):
+        displayed = (
+            bytes(controller.registers.get(DATA_START_TRANSMISSION_1, b"")),
+            bytes(controller.registers.get(DATA_START_TRANSMISSION_2, b"")),
+        )
+        if controller.partial and PARTIAL_WINDOW in controller.registers:
+            displayed = self._apply_window(controller, displayed)
+        controller.displayed = displayed
+        controller.refreshes += 1
+        controller.busy_until = self.elapsed + self.refresh_time
+        self.stats["refreshes"] += 1
+
+    def _apply_window(self, controller, window_data):
+        # Partial refresh changes only the window, rest of controller's part keeps what was displayed before
+        import display.epd12in48b as eink
+
+        (first_row, last_row), (first_column, last_column) = getattr(eink, controller.part)
+        width = last_column - first_column
+        displayed = controller.displayed or (
+            bytes([0xff]) * width * (last_row - first_row),
+            bytes(width * (last_row - first_row)),
+        )
+        window = controller.registers[PARTIAL_WINDOW]
+        hrst, hred = (window[0] << 8 | window[1]) // 8, (window[2] << 8 | window[3]) // 8
+        vrst, vred = window[4] << 8 | window[5], window[6] << 8 | window[7]
+        window_width = hred - hrst + 1
+        planes = []
+        for plane, data in zip(displayed, window_data):
+            plane = bytearray(plane)
+            for index, y in enumerate(range(vrst, vred + 1)):
+                row = data[index * window_width:(index + 1) * window_width]
+                plane[y * width + hrst:y * width + hrst + len(row)] = row
+            planes.append(bytes(plane))
+        return tuple(planes)
+
+    def _finish_refresh(self, controller):
+        if controller.busy_until is not None:
+            self.elapsed = max(self.elapsed, controller.busy_until)
+            controller.busy_until = None
+
+    def _fire_edge(self, controller):
+        with self.lock:
+            self._finish_refresh(controller)
+            self._log("edge", controller.busy_pin)
+        callback = self.callbacks.get(controller.busy_pin)
+        if callback:
+            callback(controller.busy_pin)
+
+    def _spend(self, cost, counter):
+        self.elapsed += cost
+        self.stats[counter] += 1
+
+    def _log(self, operation, *args):
+        if self.record:
+            self.log.append((self.elapsed, operation) + args)
@@ -7,9 +7,11 @@ import os
 from display.display import Display
 from modules.config import ConfigLoader
 from modules.calendar import Calendar
+from modules.http import NO_RETRIES, Session, get_session
 from modules.logger import log_setup
+from modules import metrics
 from modules.power import Power
-from modules.render import TemplateRenderer
+from modules.render import get_renderer
 from modules.schedule import Scheduler
 from modules.weather import Weather
 
@@ -19,8 +21,10 @@ logger = logging.getLogger('MagInkCal')
 
 
 def is_connected_to_internet(url='https://www.google.com/', timeout=5):
+    # Shared session retries failed connections, offline device would wait for all of them
     try:
-        requests.head(url, timeout=timeout)
+        with Session(retries=NO_RETRIES) as session:
+            session.head(url, timeout=timeout)
         return True
     except requests.ConnectionError:
         logger.info("No internet connection available")
@@ -28,45 +32,92 @@ def is_connected_to_internet(url='https://www.google.com/', timeout=5):
 
 
 def display_calendar():
+    metrics.start_run()
     config = ConfigLoader().config
-    has_internet = is_connected_to_internet()
+    try:
+        battery_status = update_calendar(config)
+    except Exception:
+        metrics.finish_run("failed", config.metrics_textfile)
+        raise
+    metrics.finish_run("ok", config.metrics_textfile)
+
+    if config.auto_power_off and (config.auto_power_off_while_charging or not battery_status.is_charging):
+        logger.info("Power off")
+        os.system("sudo shutdown -h now")
+
+
+def update_calendar(config):
+    # Returns battery status read during the update
+    session = get_session()
+    with metrics.span("connectivity"):
+        has_internet = is_connected_to_internet()
     power = Power()
     scheduler = Scheduler(config)
 
     if has_internet:
-        power.sync_time()
+        with metrics.span("time_sync"):
+            power.sync_time()
 
-    scheduler.schedule_next_wakeup()
+    try:
+        return refresh_calendar(config, session, has_internet, power, scheduler)
+    except Exception:
+        # device has to wake up again even when this update failed
+        with metrics.span("schedule_wakeup"):
+            scheduler.schedule_next_wakeup()
+        raise
 
-    battery_status = power.battery_status
 
-    calendar = Calendar(config)
-    calendar.load_events()
+def refresh_calendar(config, session, has_internet, power, scheduler):
+    calendar = Calendar(config, session=session)
+    with metrics.span("calendar"):
+        calendar.load_events()
 
     weather_forecast = None
     if has_internet:
-        weather_forecast = Weather(config).forecast
-
-    renderer = TemplateRenderer(config)
-
-    battery_status = power.battery_status
-
-    black_image, red_image = renderer.render(calendar, weather_forecast=weather_forecast, battery_status=battery_status)
-
-    display_service = Display(config.screen_width, config.screen_height)
-    if calendar.today.weekday() == 0:
-        display_service.calibrate(cycles=0)  # calibrate display once a week to prevent ghosting
-        logger.info("Display calibrated")
-
-    logger.info("Update display")
-    display_service.update(black_image, red_image)
-    display_service.sleep()
+        with metrics.span("weather"):
+            weather_forecast = Weather(config, session=session).forecast
+
+    renderer = get_renderer(config)
+
+    with metrics.span("battery"):
+        battery_status = power.battery_status
+
+    with metrics.span("fingerprint"):
+        fingerprint = renderer.get_fingerprint(calendar, weather_forecast=weather_forecast, battery_status=battery_status)
+    display_service = None
+    if renderer.is_displayed(fingerprint):
+        logger.info("Calendar did not change since last update, skipping display update")
+    else:
+        with metrics.span("render"):
+            black_buffer, red_buffer = renderer.render(calendar, weather_forecast=weather_forecast, battery_status=battery_status)
+
+        with metrics.span("display.init"):
+            display_service = Display(config.screen_width, config.screen_height)
+        # calibrate display once ghosting could have built up
+        if display_service.needs_calibration(
+            config.calibration_max_refreshes, config.calibration_max_changed, config.calibration_max_days
+        ):
+            display_service.calibrate(cycles=config.calibration_cycles)
+            logger.info("Display calibrated")
+
+        logger.info("Update display")
+        # panel refreshes for a while, work that doesn't touch it continues meanwhile
+        dirty_rects = display_service.get_dirty_rects(black_buffer, red_buffer, config.partial_refresh_limit)
+        display_service.update(black_buffer, red_buffer, wait=False, dirty_rects=dirty_rects)
+
+    # panel doesn't take part in these, they run while it refreshes
+    with metrics.span("schedule_wakeup"):
+        scheduler.schedule_next_wakeup()
+    with metrics.span("calendar.save"):
+        calendar.save_events()
 
     logger.info("Completed daily calendar update")
 
-    if config.auto_power_off and (config.auto_power_off_while_charging or not battery_status.is_charging):
-        logger.info("Power off")
-        os.system("sudo shutdown -h now")
+    if display_service:
+        display_service.sleep()  # waits for the refresh to finish
+        renderer.save_fingerprint(fingerprint)
+
+    return battery_status
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import html
+import io
+import logging
+import mimetypes
+import os
+import pathlib
+import re
+import string
+
+from PIL import Image
+from typing import List, NamedTuple, Optional
+
+try:
+    from fontTools import subset
+except ImportError:  # fonts are linked in full when fontTools is not installed
+    subset = None
+
+
+logger = logging.getLogger('assets')
+
+
+STATIC_PATH = f"{pathlib.Path(__file__).parent.parent.absolute()}/static"
+# Only faces the template actually uses, font-weight 500 falls back to the regular face as before
+FONT_FACES = (
+    ("300", "Lato-Light.ttf"),
+    ("normal", "Lato-Regular.ttf"),
+    ("bold", "Lato-Bold.ttf"),
+    ("900", "Lato-Black.ttf"),
+)
+# Always kept in subsets: printable Latin-1 and a few symbols the template uses. The cached subset is reused
+# as long as event titles stay within it, other characters seen in titles are added on top.
+BASE_CHARACTERS = string.printable + "".join(map(chr, range(0xA0, 0x100))) + "°…"
+
+
+class FontFace(NamedTuple):
+    weight: str
+    src: str
+    format: str
+
+
+def get_text(document: str) -> str:
+    document = re.sub(r"<(style|script)[^>]*>.*?</\1>", "", document, flags=re.DOTALL)
+    return html.unescape(re.sub(r"<[^>]+>", "", document))
+
+
+class AssetBundle:
+    # Inlines fonts and images into the rendered document, so Chromium doesn't have to open any files
+
+    def __init__(self, workdir: str):
+        self.cache_dir = f"{workdir}/assets"
+        self.images = {}
+
+    def get_font_faces(self, text: str) -> List[FontFace]:
+        if subset is None:
+            logger.warning("fontTools is not installed, linking full fonts")
+            return [FontFace(weight, f"../static/fonts/Lato/{file_name}", "truetype") for weight, file_name in FONT_FACES]
+
+        characters = "".join(sorted(set(BASE_CHARACTERS + text)))
+        font_faces = [
+            FontFace(weight, self._get_data_uri(self._get_font_subset(file_name, characters), "font/woff"), "woff")
+            for weight, file_name in FONT_FACES
+        ]
+        self._prune_font_subsets(characters)
+        return font_faces
+
+    def get_image(self, path: str, size: Optional[int] = None) -> str:
+        # Returns image from static directory as data URI, raster images are scaled down to displayed size.
+        # Template asks for the same icons many times, each one is loaded once per bundle.
+        if (path, size) not in self.images:
+            self.images[(path, size)] = self._load_image(path, size)
+        return self.images[(path, size)]
+
+    def _load_image(self, path: str, size: Optional[int] = None) -> str:
+        file_path = f"{STATIC_PATH}/{path}"
+        mime_type = mimetypes.guess_type(file_path)[0]
+        if size is None or mime_type != "image/png":
+            with open(file_path, "rb") as image_file:
+                return self._get_data_uri(image_file.read(), mime_type)
+
+        def scale_image() -> bytes:
+            output = io.BytesIO()
+            with Image.open(file_path) as image:
+                image.convert("RGBA").resize((size, size), Image.LANCZOS).save(output, "PNG", optimize=True)
+            return output.getvalue()
+
+        return self._get_data_uri(self._get_cached(f"{path}:{size}", "png", scale_image), mime_type)
+
+    def _get_font_subset(self, file_name: str, characters: str) -> bytes:
+        def build_subset() -> bytes:
+            options = subset.Options()
+            options.flavor = "woff"
+            options.layout_features = ["*"]
+            font = subset.load_font(f"{STATIC_PATH}/fonts/Lato/{file_name}", options)
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(text=characters)
+            subsetter.subset(font)
+            output = io.BytesIO()
+            subset.save_font(font, output, options)
+            logger.info(f"Font {file_name} subset to {len(characters)} characters")
+            return output.getvalue()
+
+        return self._get_cached(f"{file_name}:{characters}", "woff", build_subset)
+
+    def _prune_font_subsets(self, characters: str) -> None:
+        # Subsets for other characters would pile up in the cache with every new title, only current ones are kept
+        current = {f"{self._get_cache_name(f'{file_name}:{characters}')}.woff" for _, file_name in FONT_FACES}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".woff") and name not in current:
+                os.remove(f"{self.cache_dir}/{name}")
+
+    def _get_cached(self, key: str, extension: str, build) -> bytes:
+        path = f"{self.cache_dir}/{self._get_cache_name(key)}.{extension}"
+        try:
+            with open(path, "rb") as cached_file:
+                return cached_file.read()
+        except OSError:
+            pass
+
+        data = build()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(f"{path}.tmp", "wb") as cached_file:
+            cached_file.write(data)
+        os.replace(f"{path}.tmp", path)
+        return data
+
+    def _get_cache_name(self, key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _get_data_uri(self, data: bytes, mime_type: str) -> str:
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import requests
+
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urljoin
+from xml.etree import ElementTree
+
+
+logger = logging.getLogger('caldav')
+
+
+DAV = "DAV:"
+CALDAV = "urn:ietf:params:xml:ns:caldav"
+SYNC_COLLECTION = f"""<?xml version="1.0" encoding="utf-8"?>
+<D:sync-collection xmlns:D="{DAV}" xmlns:C="{CALDAV}">
+  <D:sync-token>{{token}}</D:sync-token>
+  <D:sync-level>1</D:sync-level>
+  <D:prop><D:getetag/><C:calendar-data/></D:prop>
+</D:sync-collection>"""
+CALENDAR_MULTIGET = f"""<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-multiget xmlns:D="{DAV}" xmlns:C="{CALDAV}">
+  <D:prop><D:getetag/><C:calendar-data/></D:prop>
+  {{hrefs}}
+</C:calendar-multiget>"""
+# Servers may return changes in several parts, each one continuing from the token of the previous one
+MAX_SYNC_ROUNDS = 20
+
+
+class SyncTokenInvalid(Exception):
+    pass
+
+
+class CalDavCollection:
+    # Calendar collection kept in sync with sync-collection REPORT (RFC 6578). Calendar objects and the sync token
+    # are stored at store_path, after the first sync a wakeup only transfers what changed since the last one.
+
+    def __init__(self, session: requests.Session, url: str, store_path: str, auth: Optional[Tuple[str, str]] = None):
+        self.session = session
+        self.url = url
+        self.store_path = store_path
+        self.auth = auth
+
+    def sync(self, ics_path: str) -> str:
+        # Applies changes from the server, writes all calendar objects to ics_path and returns SHA-256 of its content
+        store = self._load_store()
+        try:
+            changed = self._apply_changes(store)
+        except SyncTokenInvalid:
+            logger.info(f"Sync token of {self.url} is no longer valid, synchronizing whole collection")
+            store = {"token": "", "objects": {}, "content_hash": None}
+            changed = self._apply_changes(store)
+        if changed or not store["content_hash"] or not os.path.exists(ics_path):
+            store["content_hash"] = self._write_calendar(store["objects"], ics_path)
+        self._save_store(store)
+        return store["content_hash"]
+
+    def _apply_changes(self, store: dict) -> bool:
+        changed = False
+        for _ in range(MAX_SYNC_ROUNDS):
+            token, updated, removed, truncated = self._report_changes(store["token"])
+            missing = [href for href, (etag, data) in updated.items() if data is None]
+            if missing:
+                # Servers may write hrefs in their answer differently, so they are matched as absolute URLs
+                returned = self._get_objects(missing)
+                not_returned = []
+                for href in missing:
+                    etag, data = returned.get(self._get_url(href), (None, None))
+                    if data is None:
+                        not_returned.append(href)
+                    updated[href] = (etag or updated[href][0], data)
+                # Token must not be saved before all changes it covers are stored, they would never be sent again
+                if not_returned:
+                    raise ValueError(f"Calendar {self.url} didn't return data of {', '.join(not_returned)}")
+            for href, (etag, data) in updated.items():
+                if data is not None:
+                    store["objects"][href] = {"etag": etag, "data": data}
+            for href in removed:
+                store["objects"].pop(href, None)
+            changed = changed or bool(updated or removed)
+            logger.info(f"Calendar {self.url}: {len(updated)} objects changed, {len(removed)} removed")
+            store["token"] = token
+            if not truncated:
+                break
+        return changed
+
+    def _report_changes(self, token: str) -> Tuple[str, Dict[str, Tuple[str, Optional[str]]], List[str], bool]:
+        response = self.session.request(
+            "REPORT",
+            self.url,
+            data=SYNC_COLLECTION.format(token=_escape(token)).encode("utf-8"),
+            headers={"Content-Type": "application/xml; charset=utf-8", "Depth": "0"},
+            auth=self.auth,
+        )
+        if token and response.status_code in (403, 409) and b"valid-sync-token" in response.content:
+            raise SyncTokenInvalid()
+        response.raise_for_status()
+        root = ElementTree.fromstring(response.content)
+
+        updated = {}
+        removed = []
+        truncated = False
+        for item in root.iter(f"{{{DAV}}}response"):
+            href = item.findtext(f"{{{DAV}}}href")
+            status = item.findtext(f"{{{DAV}}}status") or ""
+            if " 404 " in status:
+                removed.append(href)
+            elif " 507 " in status:
+                truncated = True
+            else:
+                updated[href] = _get_object(item)
+        new_token = root.findtext(f"{{{DAV}}}sync-token")
+        if not new_token:
+            raise ValueError(f"Calendar {self.url} didn't return a sync token")
+        return new_token, updated, removed, truncated
+
+    def _get_objects(self, hrefs: List[str]) -> Dict[str, Tuple[str, Optional[str]]]:
+        # Data of objects the server didn't send with the changes
+        response = self.session.request(
+            "REPORT",
+            self.url,
+            data=CALENDAR_MULTIGET.format(
+                hrefs="".join(f"<D:href>{_escape(href)}</D:href>" for href in hrefs)
+            ).encode("utf-8"),
+            headers={"Content-Type": "application/xml; charset=utf-8", "Depth": "1"},
+            auth=self.auth,
+        )
+        response.raise_for_status()
+        root = ElementTree.fromstring(response.content)
+        return {
+            self._get_url(item.findtext(f"{{{DAV}}}href") or ""): _get_object(item)
+            for item in root.iter(f"{{{DAV}}}response")
+        }
+
+    def _get_url(self, href: str) -> str:
+        return urljoin(self.url, unquote(href))
+
+    def _write_calendar(self, objects: Dict[str, dict], ics_path: str) -> str:
+        # Every object is a VCALENDAR of its own, the parser reads them one after another.
+        # Objects are ordered by href, so the same objects always give the same file.
+        content_hash = hashlib.sha256()
+        temporary_path = f"{ics_path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as ics_file:
+            for href in sorted(objects):
+                data = objects[href]["data"].encode("utf-8")
+                if not data.endswith(b"\n"):
+                    data += b"\r\n"
+                content_hash.update(data)
+                ics_file.write(data)
+        os.replace(temporary_path, ics_path)
+        return content_hash.hexdigest()
+
+    def _load_store(self) -> dict:
+        try:
+            with open(self.store_path, "r") as store_file:
+                return json.loads(store_file.read())
+        except (OSError, ValueError):
+            return {"token": "", "objects": {}, "content_hash": None}
+
+    def _save_store(self, store: dict) -> None:
+        temporary_path = f"{self.store_path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as store_file:
+            store_file.write(json.dumps(store))
+        os.replace(temporary_path, self.store_path)
+
+
+def _get_object(item: ElementTree.Element) -> Tuple[str, Optional[str]]:
+    # ETag and calendar data of a multistatus response, data is None when the server left it out
+    etag = None
+    data = None
+    for propstat in item.iter(f"{{{DAV}}}propstat"):
+        if " 200 " not in (propstat.findtext(f"{{{DAV}}}status") or " 200 "):
+            continue
+        etag = propstat.findtext(f"{{{DAV}}}prop/{{{DAV}}}getetag") or etag
+        data = propstat.findtext(f"{{{DAV}}}prop/{{{CALDAV}}}calendar-data") or data
+    return etag, data
+
+
+def _escape(value: str) -> str:
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -1,18 +1,26 @@
 import functools
+import hashlib
 import json
 import logging
+import os
 import pathlib
 import requests
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from dateutil import rrule
-from ics import Calendar as IcsCalendar, Event as IcsEvent
-from modules.config import Config
+from modules import eventcache, metrics
+from modules.caldav import CalDavCollection
+from modules.config import Calendar as CalendarConfig, Config
+from modules.http import get_session
+from modules.ical import VEvent, build_event, can_overlap, get_component_key, read_components
 from pydantic import BaseModel
 from pytz import timezone
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-SUPPORTED_RRULE_PROPERTIES = ("RRULE", "RDATE", "EXRULE", "EXDATE", "DTSTART")
+MAX_FETCH_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+EVENT_INDEX_VERSION = 2
 
 
 logger = logging.getLogger('events')
@@ -27,6 +35,31 @@ class Event(BaseModel):
     summary: str
 
 
+class EventRecord:
+    # Lightweight event kept while events are loaded, converted to Event only when days are rendered or saved
+    __slots__ = ("all_day", "end_date", "important", "start_date", "start_time", "summary")
+
+    def __init__(self, all_day: bool, end_date: datetime, important: bool, start_date: datetime,
+                 start_time: Optional[str], summary: str):
+        self.all_day = all_day
+        self.end_date = end_date
+        self.important = important
+        self.start_date = start_date
+        self.start_time = start_time
+        self.summary = summary
+
+    def to_model(self) -> Event:
+        # Values are built by the calendar itself, so validation is skipped
+        return Event.construct(
+            all_day=self.all_day,
+            end_date=self.end_date,
+            important=self.important,
+            start_date=self.start_date,
+            start_time=self.start_time,
+            summary=self.summary,
+        )
+
+
 class Day(BaseModel):
     date_label: str
     datetime: datetime
@@ -79,13 +112,16 @@ def _get_month_preview(month_offset: int) -> Month:
 
 class Calendar:
     config: Config
-    days: Dict[str, Day]
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, session: requests.Session = None):
         self.config = config
+        self.session = session or get_session()
         self.timezone = timezone(config.timezone)
-        self.days = self._get_empty_days_range()
+        # Events of each displayed day, indexed by days since start_date
+        self.day_events: List[List[EventRecord]] = [[] for _ in range(7 * config.number_of_weeks)]
+        self._days = None
         self.workdir = f"{pathlib.Path(__file__).parent.parent.absolute()}/build"
+        self.events_cache_path = f"{self.workdir}/events.bin"
         self.offline_events = False
 
     @property
@@ -103,121 +139,285 @@ class Calendar:
     def end_date(self) -> datetime:
         return self.start_date + timedelta(weeks=self.config.number_of_weeks)
 
+    @property
+    def days(self) -> Dict[str, Day]:
+        # Displayed days by date label, built from day_events when first needed
+        if self._days is None:
+            self._days = self._build_days()
+        return self._days
+
     def load_events(self) -> None:
         logger.info(f"Fetching events from {len(self.config.calendars)} calendars")
         try:
             number_of_events = 0
-            for calendar in self.config.calendars:
-                ics_calendar = IcsCalendar(requests.get(calendar.url).text)
-                for event in ics_calendar.events:
-                    event_description = event.serialize()
-                    if "RRULE" in event_description:
-                        number_of_events += self._process_recurring_event(event, event_description, calendar.important)
-                    else:
-                        number_of_events += self._process_single_event(event, calendar.important)
+            for index, (calendar, (ics_path, content_hash)) in enumerate(zip(self.config.calendars, self._fetch_calendars())):
+                with metrics.span("calendar.parse", calendar=index):
+                    number_of_events += self._load_calendar_events(calendar, ics_path, content_hash)
             self._sort_events()
             logger.info(f"Fetched {number_of_events} events to display")
-            self._save_events_to_file()
+            metrics.set_value("events", number_of_events)
         except Exception:
             logger.error("Failed to fetch events", exc_info=True)
             self.offline_events = True
             self._load_events_from_file()
 
-    def _save_events_to_file(self):
+    def save_events(self) -> None:
+        # Keeps fetched events for updates without internet, events loaded from that file are not saved again
+        if self.offline_events:
+            return
+        try:
+            self._save_events_to_file()
+        except OSError:
+            logger.warning("Failed to save events to file", exc_info=True)
+
+    def _fetch_calendars(self) -> List[Tuple[str, Optional[str]]]:
+        # Downloads all calendars at once, paths and hashes of downloaded files are in configuration order
+        with ThreadPoolExecutor(max_workers=min(len(self.config.calendars), MAX_FETCH_WORKERS)) as executor:
+            return list(executor.map(self._fetch_calendar, range(len(self.config.calendars)), self.config.calendars))
+
+    def _fetch_calendar(self, index: int, calendar: CalendarConfig) -> Tuple[str, Optional[str]]:
+        # Calendar is streamed to build/calendars, it's downloaded again only when it changed since then.
+        # Returns path of the file and SHA-256 of its content.
+        with metrics.span("calendar.fetch", calendar=index):
+            if calendar.type == "caldav":
+                return self._sync_calendar(calendar)
+            return self._download_calendar(calendar)
+
+    def _sync_calendar(self, calendar: CalendarConfig) -> Tuple[str, Optional[str]]:
+        # Calendar objects and sync token are kept in build/calendars, only changes are transferred
+        cache_path = f"{self.workdir}/calendars/{hashlib.sha256(calendar.url.encode('utf-8')).hexdigest()}"
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        auth = (calendar.username, calendar.password) if calendar.username else None
+        collection = CalDavCollection(self.session, calendar.url, f"{cache_path}.caldav.json", auth)
+        return f"{cache_path}.ics", collection.sync(f"{cache_path}.ics")
+
+    def _download_calendar(self, calendar: CalendarConfig) -> Tuple[str, Optional[str]]:
+        cache_path = f"{self.workdir}/calendars/{hashlib.sha256(calendar.url.encode('utf-8')).hexdigest()}"
+        ics_path = f"{cache_path}.ics"
+        metadata = self._load_calendar_metadata(cache_path)
+        headers = {}
+        if metadata and metadata["etag"]:
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata and metadata["last_modified"]:
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+        with self.session.get(calendar.url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and metadata:
+                logger.info(f"Calendar {calendar.url} not modified, using cached copy")
+                return ics_path, metadata.get("content_hash")
+            response.raise_for_status()
+
+            # Content goes first, metadata without content is never left behind
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temporary_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            content_hash = hashlib.sha256()
+            with open(temporary_path, "wb") as ics_file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    content_hash.update(chunk)
+                    ics_file.write(chunk)
+            os.replace(temporary_path, ics_path)
+            with open(temporary_path, "w") as metadata_file:
+                json.dump(
+                    {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "content_hash": content_hash.hexdigest(),
+                    },
+                    metadata_file,
+                )
+            os.replace(temporary_path, f"{cache_path}.json")
+        return ics_path, content_hash.hexdigest()
+
+    def _load_calendar_metadata(self, cache_path: str) -> Optional[dict]:
+        if not os.path.exists(f"{cache_path}.ics"):
+            return None
+        try:
+            with open(f"{cache_path}.json", "r") as metadata_file:
+                return json.load(metadata_file)
+        except (OSError, ValueError):
+            return None
+
+    def _load_calendar_events(self, calendar: CalendarConfig, ics_path: str, content_hash: Optional[str]) -> int:
+        # Feed with the same content as the last time isn't read at all, occurrences come from its index.
+        # Otherwise events that didn't change reuse their occurrences from the index, only added and modified ones
+        # are built and expanded, removed ones drop out of the index.
+        index_path = f"{os.path.splitext(ics_path)[0]}.events.json"
+        previous_index = self._load_event_index(index_path)
+        if previous_index and content_hash and previous_index["content_hash"] == content_hash:
+            logger.info(f"Calendar {calendar.url}: content unchanged, using indexed events")
+            return self._add_indexed_events(previous_index["events"], calendar.important)
+
+        previous_events = {key: occurrences for key, occurrences in previous_index.get("events", ()) if key is not None}
         events = []
-        for label, day in self.days.items():
-            events.append(json.loads(day.json()))
-        with open(f"{self.workdir}/events.json", "w") as output_file:
-            output_file.write(json.dumps(events))
+        keys = set()
+        duplicate_keys = set()
+        number_of_events = 0
+        expanded_events = 0
+        with open(ics_path, "r", encoding="utf-8", errors="replace") as ics_file:
+            for component, timezones in read_components(ics_file, self.timezone):
+                key = get_component_key(component)
+                if key is not None and key in previous_events and key not in keys:
+                    occurrences = previous_events[key]
+                    records = [self._load_indexed_occurrence(occurrence, calendar.important) for occurrence in occurrences]
+                else:
+                    records = self._expand_event(build_event(component, timezones), calendar.important)
+                    occurrences = [self._get_indexed_occurrence(record) for record in records]
+                    expanded_events += 1
+                if key in keys:
+                    duplicate_keys.add(key)
+                keys.add(key)
+                events.append([key, occurrences])
+                for record in records:
+                    self._add_event(record)
+                number_of_events += len(records)
+        logger.info(f"Calendar {calendar.url}: {expanded_events} of {len(events)} events expanded")
+        # Occurrences of a key repeated in the feed can't be told apart, so they are always expanded
+        events = [[None if key in duplicate_keys else key, occurrences] for key, occurrences in events]
+        # A changed content hash alone is still saved, so the next run with the same content doesn't read the feed
+        if previous_index.get("events") != events or previous_index.get("content_hash") != content_hash:
+            self._save_event_index(index_path, {"content_hash": content_hash, "events": events})
+        return number_of_events
+
+    def _add_indexed_events(self, events: List[list], important: bool) -> int:
+        number_of_events = 0
+        for key, occurrences in events:
+            for occurrence in occurrences:
+                self._add_event(self._load_indexed_occurrence(occurrence, important))
+            number_of_events += len(occurrences)
+        return number_of_events
+
+    def _load_event_index(self, index_path: str) -> dict:
+        # Occurrences are only valid for the window and time zone they were expanded in
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.loads(index_file.read())
+        except (OSError, ValueError):
+            return {}
+        if index.get("version") != EVENT_INDEX_VERSION or index.get("window") != self._get_index_window():
+            return {}
+        return index
+
+    def _save_event_index(self, index_path: str, index: dict) -> None:
+        # Events are kept in feed order with their keys, None for events that can't be reused by key
+        index = dict(index, version=EVENT_INDEX_VERSION, window=self._get_index_window())
+        temporary_path = f"{index_path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as index_file:
+            index_file.write(json.dumps(index, separators=(",", ":")))
+        os.replace(temporary_path, index_path)
+
+    def _load_indexed_occurrence(self, occurrence: list, important: bool) -> EventRecord:
+        all_day, start_date, end_date, start_time, summary = occurrence
+        return EventRecord(
+            all_day,
+            datetime.fromisoformat(end_date).astimezone(self.timezone),
+            important,
+            datetime.fromisoformat(start_date).astimezone(self.timezone),
+            start_time,
+            summary,
+        )
+
+    def _get_indexed_occurrence(self, record: EventRecord) -> list:
+        return [record.all_day, record.start_date.isoformat(), record.end_date.isoformat(), record.start_time, record.summary]
+
+    def _get_index_window(self) -> List[str]:
+        return [self.start_date.isoformat(), self.end_date.isoformat(), self.config.timezone]
+
+    def _save_events_to_file(self):
+        start_ordinal = self.start_date.toordinal()
+        eventcache.save_days(
+            self.events_cache_path,
+            ((start_ordinal + index, events) for index, events in enumerate(self.day_events)),
+        )
         logger.info(f"Saved events to file")
 
     def _load_events_from_file(self):
-        with open(f"{self.workdir}/events.json", "r") as input_file:
-            events = json.loads(input_file.read())
-            for event in events:
-                day = Day(**event)
-                if day.date_label in self.days:
-                    self.days[day.date_label] = day
+        # Only days still displayed are decoded, a damaged or missing cache leaves them empty
+        start_ordinal = self.start_date.toordinal()
+        try:
+            days = eventcache.load_days(
+                self.events_cache_path,
+                range(start_ordinal, start_ordinal + len(self.day_events)),
+                self.timezone,
+            )
+        except (OSError, ValueError):
+            logger.warning("Failed to load events from file", exc_info=True)
+            return
+        for ordinal, events in days.items():
+            self.day_events[ordinal - start_ordinal] = [EventRecord(*event) for event in events]
+        self._days = None
         logger.info(f"Loaded events from file")
 
     def _is_within_range(self, date: datetime) -> bool:
         return self.start_date <= date < self.end_date
 
-    def _get_empty_days_range(self) -> Dict[str, Day]:
+    def _build_days(self) -> Dict[str, Day]:
         days = {}
-        date = self.start_date
-        while date < self.end_date:
-            day = Day(
-                date_label=date.strftime("%Y-%m-%d"),
-                datetime=date,
-                number=int(date.strftime("%d")),
-            )
-            days[day.date_label] = day
-            date = date + timedelta(days=1)
+        models = {}
+        for index, records in enumerate(self.day_events):
+            date = self.start_date + timedelta(days=index)
+            events = []
+            for record in records:
+                # Multi-day events share one model between their days
+                if id(record) not in models:
+                    models[id(record)] = record.to_model()
+                events.append(models[id(record)])
+            date_label = date.strftime("%Y-%m-%d")
+            days[date_label] = Day.construct(date_label=date_label, datetime=date, events=events, number=date.day)
         return days
 
-    def _process_single_event(self, ics_event: IcsEvent, important=False) -> int:
-        start_date = ics_event.begin.datetime.astimezone(self.timezone)
-        end_date = ics_event.end.datetime.astimezone(self.timezone)
+    def _expand_event(self, event: Optional[VEvent], important=False) -> List[EventRecord]:
+        # Occurrences of the event overlapping displayed days
+        if event is None or not can_overlap(event, self.start_date, self.end_date):
+            return []
+        if "RRULE" in event.properties or "RDATE" in event.properties:
+            return self._expand_recurring_event(event, important)
+        return self._expand_single_event(event, important)
+
+    def _expand_single_event(self, event: VEvent, important=False) -> List[EventRecord]:
+        start_date = event.begin.astimezone(self.timezone)
+        end_date = event.end.astimezone(self.timezone)
         if self._is_within_range(start_date) or self._is_within_range(end_date):
             start_time = None
-            if not ics_event.all_day:
+            if not event.all_day:
                 start_time = start_date.strftime("%H:%M")
-            self._add_event(
-                Event(
-                    all_day=ics_event.all_day,
-                    end_date=end_date,
-                    important=important,
-                    start_date=start_date,
-                    start_time=start_time,
-                    summary=ics_event.name,
-                )
-            )
-            return 1
-        return 0
-
-    def _process_recurring_event(self, ics_event: IcsEvent, event_description: str, important=False) -> int:
-        added_events = 0
-        event_duration = ics_event.end.datetime - ics_event.begin.datetime
-        rules = "\n".join([rule for rule in event_description.split("\n") if rule.startswith(SUPPORTED_RRULE_PROPERTIES)])
+            return [EventRecord(event.all_day, end_date, important, start_date, start_time, event.summary)]
+        return []
+
+    def _expand_recurring_event(self, event: VEvent, important=False) -> List[EventRecord]:
+        occurrences = []
+        event_duration = event.duration
+        starts, first_occurrence = event.get_occurrences(self.start_date, self.end_date, self.timezone)
+        # All occurrences show the hour of the first one
         start_time = None
-        for next_event_start_datetime in rrule.rrulestr(rules):
-            next_event_start_datetime = next_event_start_datetime.astimezone(self.timezone)
-            if not start_time and not ics_event.all_day:
-                start_time = next_event_start_datetime.strftime("%H:%M")
-            if next_event_start_datetime > self.end_date:
-                break
+        if first_occurrence and not event.all_day:
+            start_time = first_occurrence.strftime("%H:%M")
+        for next_event_start_datetime in starts:
             next_event_end_datetime = next_event_start_datetime + event_duration
-            if next_event_end_datetime < self.start_date:
-                continue
             if self._is_within_range(next_event_start_datetime) or self._is_within_range(next_event_end_datetime):
-                self._add_event(
-                    Event(
-                        all_day=ics_event.all_day,
-                        end_date=next_event_end_datetime,
-                        important=important,
-                        start_date=next_event_start_datetime,
-                        start_time=start_time,
-                        summary=ics_event.name,
+                occurrences.append(
+                    EventRecord(
+                        event.all_day,
+                        next_event_end_datetime,
+                        important,
+                        next_event_start_datetime,
+                        start_time,
+                        event.summary,
                     )
                 )
-                added_events += 1
-        return added_events
-
-    def _add_event(self, event: Event) -> None:
-        date_keys = []
-        date = event.start_date
-        while date < event.end_date:
-            date_keys.append(date.strftime("%Y-%m-%d"))
-            date = date + timedelta(days=1)
-
-        for key in date_keys:
-            if key in self.days:
-                self.days[key].events.append(event)
+        return occurrences
+
+    def _add_event(self, event: EventRecord) -> None:
+        # Event is shown on every day it's in progress at its start time, days are counted from its start date
+        if event.end_date <= event.start_date:
+            return
+        number_of_days = -(-(event.end_date - event.start_date) // timedelta(days=1))
+        first_day = event.start_date.toordinal() - self.start_date.toordinal()
+        for index in range(max(first_day, 0), min(first_day + number_of_days, len(self.day_events))):
+            self.day_events[index].append(event)
+        self._days = None
 
     def _sort_events(self) -> None:
-        # Sort events in the day by hour and calendar order
-        for key, events in self.days.items():
-            day_events = [(i, event) for i, event in enumerate(self.days[key].events)]
-            day_events.sort(key=lambda item: (item[1].start_time or "00:00", item[0]))
-            self.days[key].events = [event for i, event in day_events]
+        # Sort events in the day by hour and calendar order, sorting is stable
+        for events in self.day_events:
+            events.sort(key=lambda event: event.start_time or "00:00")
+        self._days = None
@@ -0,0 +1,176 @@
+import base64
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import requests
+import websocket
+
+from modules import metrics
+from typing import Optional
+
+
+logger = logging.getLogger('chromium')
+
+
+STARTUP_TIMEOUT = 30
+COMMAND_TIMEOUT = 30
+
+# Resolves once web fonts and all images of the document are loaded and two frames were painted
+DOCUMENT_READY_SCRIPT = """
+Promise.all([
+    document.fonts.ready,
+    ...Array.from(document.images).map(
+        (image) => image.complete ? null : new Promise((resolve) => { image.onload = image.onerror = resolve; })
+    ),
+]).then(() => new Promise((resolve) => requestAnimationFrame(() => requestAnimationFrame(() => resolve(true)))))
+"""
+
+
+class ChromiumError(Exception):
+    pass
+
+
+class Chromium:
+    # Minimal Chrome DevTools Protocol client driving a headless Chromium process
+
+    def __init__(self, binary: str, width: int, height: int):
+        self.binary = binary
+        self.width = width
+        self.height = height
+        self.process = None
+        self.profile_dir = None
+        self.connection = None
+        self.last_id = 0
+        self.events = []
+
+    def __enter__(self) -> "Chromium":
+        with metrics.span("render.browser_start"):
+            self._start()
+        return self
+
+    def _start(self) -> None:
+        self.profile_dir = tempfile.TemporaryDirectory(prefix="maginkcal-chromium-")
+        self.process = subprocess.Popen(
+            (
+                self.binary,
+                "--headless",
+                "--disable-gpu",
+                "--hide-scrollbars",
+                "--force-device-scale-factor=1",
+                "--no-first-run",
+                "--no-default-browser-check",
+                "--remote-debugging-port=0",
+                f"--user-data-dir={self.profile_dir.name}",
+                f"--window-size={self.width},{self.height}",
+                "about:blank",
+            ),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.connection = websocket.create_connection(
+                self._get_page_websocket_url(),
+                timeout=COMMAND_TIMEOUT,
+                suppress_origin=True,
+            )
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        logger.info("Chromium started")
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        if self.profile_dir:
+            self.profile_dir.cleanup()
+            self.profile_dir = None
+
+    def screenshot(self, html: str, base_url: str) -> bytes:
+        # Loads the HTML straight into the page (base_url is used to resolve relative URLs)
+        # and returns PNG bytes as soon as the document is ready
+        self.command("Page.enable")
+        self.command(
+            "Emulation.setDeviceMetricsOverride",
+            width=self.width,
+            height=self.height,
+            deviceScaleFactor=1,
+            mobile=False,
+        )
+        frame = self.command("Page.navigate", url=base_url)
+        self.wait_for_event("Page.loadEventFired")
+        self.command("Page.setDocumentContent", frameId=frame["frameId"], html=html)
+        self.command("Runtime.evaluate", expression=DOCUMENT_READY_SCRIPT, awaitPromise=True)
+
+        result = self.command(
+            "Page.captureScreenshot",
+            format="png",
+            clip={"x": 0, "y": 0, "width": self.width, "height": self.height, "scale": 1},
+        )
+        return base64.b64decode(result["data"])
+
+    def command(self, method: str, **params) -> dict:
+        self.last_id += 1
+        message_id = self.last_id
+        self.connection.send(json.dumps({"id": message_id, "method": method, "params": params}))
+        while True:
+            message = json.loads(self.connection.recv())
+            if message.get("id") == message_id:
+                if "error" in message:
+                    raise ChromiumError(f"{method} failed: {message['error'].get('message')}")
+                result = message.get("result", {})
+                if result.get("exceptionDetails"):
+                    raise ChromiumError(f"{method} failed: {result['exceptionDetails'].get('text')}")
+                return result
+            if "method" in message:
+                self.events.append(message)
+
+    def wait_for_event(self, method: str, timeout: float = COMMAND_TIMEOUT) -> dict:
+        deadline = time.monotonic() + timeout
+        while True:
+            for event in self.events:
+                if event["method"] == method:
+                    self.events.remove(event)
+                    return event
+            if time.monotonic() > deadline:
+                raise ChromiumError(f"Timed out waiting for {method}")
+            message = json.loads(self.connection.recv())
+            if "method" in message:
+                self.events.append(message)
+
+    def _get_page_websocket_url(self) -> str:
+        # Chromium writes chosen debugging port to DevToolsActivePort file in its profile directory
+        port_file = os.path.join(self.profile_dir.name, "DevToolsActivePort")
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise ChromiumError(f"Chromium exited with code {self.process.returncode}")
+            port = self._read_port(port_file)
+            if port:
+                try:
+                    targets = requests.get(f"http://127.0.0.1:{port}/json/list", timeout=1).json()
+                except requests.RequestException:
+                    targets = []
+                for target in targets:
+                    if target.get("type") == "page":
+                        return target["webSocketDebuggerUrl"]
+            time.sleep(0.05)
+        raise ChromiumError("Chromium did not start in time")
+
+    def _read_port(self, port_file: str) -> Optional[int]:
+        try:
+            with open(port_file) as file:
+                return int(file.readline())
+        except (OSError, ValueError):
+            return None
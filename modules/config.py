@@ -11,6 +11,10 @@ from typing import List, Optional
 logger = logging.getLogger('config')
 
 
+CALENDAR_TYPES = ("ics", "caldav")
+RENDERERS = ("chromium", "pillow")
+
+
 class I18nConfig(BaseModel):
     header_months = [
         "January",
@@ -54,20 +58,34 @@ class WeatherConfig(BaseModel):
 class Calendar(BaseModel):
     url: str
     important = False
+    # "ics" downloads the whole feed, "caldav" synchronizes only changes of a CalDAV collection
+    type = "ics"
+    username: Optional[str] = None
+    password: Optional[str] = None
 
 
 class Config(BaseModel):
     auto_power_off = True
     auto_power_off_while_charging = True
+    black_plane_threshold = 0
     display_battery = True
     calendars: List[Calendar]
+    calibration_cycles = 1
+    calibration_max_changed = 3.0
+    calibration_max_days = 7
+    calibration_max_refreshes = 10
+    chromium_path = "chromium-browser"
     detailed_weeks = 0
     i18n: I18nConfig
     image_width = 1304
     image_height = 984
     max_events_per_day = 5
+    metrics_textfile: Optional[str] = None
     number_of_months = 0
     number_of_weeks = 4
+    partial_refresh_limit = 0.0
+    red_plane_threshold = 0
+    renderer = "chromium"
     rotate = 0
     screen_width = 1304
     screen_height = 984
@@ -88,6 +106,11 @@ class ConfigLoader:
         config = Config(**config_data)
 
         assert len(config.calendars) > 0, "No calendars configured"
+        for calendar in config.calendars:
+            assert calendar.type in CALENDAR_TYPES, f"Calendar type must be one of: {', '.join(CALENDAR_TYPES)}"
         assert config.number_of_months <= 2, "Maximum number of months is 2"
+        assert config.calibration_cycles >= 0, "Number of calibration cycles can't be negative"
+        assert 0 <= config.partial_refresh_limit <= 1, "Partial refresh limit must be between 0 and 1"
+        assert config.renderer in RENDERERS, f"Renderer must be one of: {', '.join(RENDERERS)}"
 
         return config
@@ -0,0 +1,386 @@
+import functools
+import logging
+import pathlib
+
+from modules import metrics
+from modules.calendar import Calendar, Day, Month, get_months_preview
+from modules.power import BatteryStatus
+from modules.render import Renderer
+from modules.weather import ForecastDay
+from PIL import Image, ImageDraw, ImageFont
+from typing import List, Optional, Tuple
+
+
+logger = logging.getLogger('draw')
+
+
+STATIC_PATH = f"{pathlib.Path(__file__).parent.parent.absolute()}/static"
+FONT_FILES = {
+    300: "Lato-Light.ttf",
+    400: "Lato-Regular.ttf",
+    700: "Lato-Bold.ttf",
+    900: "Lato-Black.ttf",
+}
+ROOT_FONT_SIZE = 16
+ICONS_SUPERSAMPLING = 4
+
+BLACK = (0, 0, 0)
+GRAY = (108, 117, 125)
+GRAY_DARK = (52, 58, 64)
+LIGHT_RED = (220, 53, 69)
+RED = (255, 0, 0)
+WHITE = (255, 255, 255)
+
+# Sizes below mirror the stylesheet of template/calendar_template.jinja2
+TODAY_PADDING = 20
+TODAY_WIDTH = 400
+TODAY_LABEL_MARGIN = 6
+TODAY_NUMBER_LINE_HEIGHT = 48
+TODAY_MONTH_MARGIN = 5
+TODAY_MONTH_PADDING = 16
+WEATHER_IMAGE_SIZE = 48
+PREVIEW_MARGIN_RIGHT = 40
+PREVIEW_PADDING = 15
+PREVIEW_MONTH_MARGIN = 40
+PREVIEW_MONTH_WIDTH = 300
+PREVIEW_MONTH_NAME_MARGIN = 5
+PREVIEW_MONTH_NAME_MARGIN_BOTTOM = 6
+PREVIEW_DAYS_MIN_HEIGHT = 160
+PREVIEW_DAY_HEIGHT = 28
+PREVIEW_TODAY_RADIUS = 13
+BATTERY_RIGHT = 16
+BATTERY_TOP = 15
+BATTERY_WIDTH = 30
+NO_WIFI_RIGHT = 20
+NO_WIFI_TOP = 18
+NO_WIFI_BELOW_BATTERY_TOP = 48
+NO_WIFI_WIDTH = 24
+DAYS_MARGIN = 20
+DAY_PADDING = 10
+DAY_NUMBER_WIDTH = 52
+DAY_NUMBER_HEIGHT = 42
+DAY_NUMBER_LINE_HEIGHT = 40
+DETAILED_DAY_NUMBER_HEIGHT = 52
+DETAILED_DAY_NUMBER_LINE_HEIGHT = 50
+DAY_TODAY_RADIUS = 25
+EVENT_HEIGHT = 24
+DETAILED_EVENT_HEIGHT = 28
+
+
+@functools.lru_cache()
+def _font(weight: int, size: float) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(f"{STATIC_PATH}/fonts/Lato/{FONT_FILES[weight]}", round(size))
+
+
+@functools.lru_cache()
+def _weather_icon(path: str, size: int) -> Image.Image:
+    with Image.open(path) as source:
+        return source.convert("RGBA").resize((size, size), Image.LANCZOS)
+
+
+def _rem(value: float) -> float:
+    return value * ROOT_FONT_SIZE
+
+
+def _line_height(font: ImageFont.FreeTypeFont) -> int:
+    ascent, descent = font.getmetrics()
+    return ascent + descent
+
+
+def _baseline(font: ImageFont.FreeTypeFont, top: float, line_height: Optional[float] = None) -> float:
+    # Text is vertically centered in its line box the same way browser does it (half-leading)
+    ascent, descent = font.getmetrics()
+    if line_height is None:
+        line_height = ascent + descent
+    return top + (line_height - ascent - descent) / 2 + ascent
+
+
+def _ellipsize(parts: List[Tuple[str, ImageFont.FreeTypeFont]], width: float) -> List[Tuple[str, ImageFont.FreeTypeFont]]:
+    # Mimics "text-overflow: ellipsis" on a line built from several differently styled spans
+    if sum(font.getlength(text) for text, font in parts) <= width:
+        return parts
+    result = []
+    available = width
+    for text, font in parts:
+        ellipsis_width = font.getlength("…")
+        if font.getlength(text) + ellipsis_width <= available:
+            result.append((text, font))
+            available -= font.getlength(text)
+            continue
+        while text and font.getlength(text) + ellipsis_width > available:
+            text = text[:-1]
+        result.append((text + "…", font))
+        break
+    return result
+
+
+class PillowRenderer(Renderer):
+    layout_path = __file__
+
+    def render(self, calendar: Calendar, battery_status: BatteryStatus = None, weather_forecast: ForecastDay = None):
+        with metrics.span("render.draw"):
+            image = Image.new("RGB", (self.config.image_width, self.config.image_height), WHITE)
+            draw = ImageDraw.Draw(image)
+
+            header_height = self._draw_header(image, draw, calendar, weather_forecast)
+            self._draw_status_icons(image, calendar, battery_status)
+            self._draw_days(image, draw, calendar, header_height)
+
+        logger.info("Image drawn")
+
+        return self._pack_planes(image)
+
+    def _draw_header(self, image: Image.Image, draw: ImageDraw.ImageDraw, calendar: Calendar, weather_forecast: ForecastDay = None) -> int:
+        months = list(get_months_preview(self.config.number_of_months))
+        months_height = max([self._get_preview_month_height(month) for month in months] + [0])
+
+        label_height = self._draw_today_label(draw, calendar)
+        today_height = label_height
+        if weather_forecast:
+            today_height += self._get_weather_height()
+
+        header_height = max(today_height + 2 * TODAY_PADDING, months_height + 2 * PREVIEW_PADDING)
+
+        if weather_forecast:
+            self._draw_weather(image, draw, weather_forecast, header_height - TODAY_PADDING)
+
+        x = self.config.image_width - PREVIEW_MARGIN_RIGHT - PREVIEW_PADDING
+        x -= len(months) * (PREVIEW_MONTH_MARGIN + PREVIEW_MONTH_WIDTH)
+        for month in months:
+            x += PREVIEW_MONTH_MARGIN
+            self._draw_preview_month(image, draw, month, x, PREVIEW_PADDING, months_height)
+            x += PREVIEW_MONTH_WIDTH
+
+        return header_height
+
+    def _draw_today_label(self, draw: ImageDraw.ImageDraw, calendar: Calendar) -> int:
+        number_font = _font(900, _rem(4))
+        month_font = _font(400, _rem(2))
+        x = TODAY_PADDING + TODAY_LABEL_MARGIN
+        top = TODAY_PADDING
+
+        number = calendar.today.strftime("%-d")
+        draw.text((x, _baseline(number_font, top, TODAY_NUMBER_LINE_HEIGHT)), number, font=number_font, fill=BLACK, anchor="ls")
+        x += number_font.getlength(number) + TODAY_MONTH_MARGIN
+
+        month = self.config.i18n.header_months[calendar.today.month - 1]
+        month_top = top + TODAY_MONTH_PADDING
+        draw.text((x, _baseline(month_font, month_top)), month, font=month_font, fill=BLACK, anchor="ls")
+
+        return max(TODAY_NUMBER_LINE_HEIGHT, TODAY_MONTH_PADDING + _line_height(month_font))
+
+    def _get_weather_height(self) -> int:
+        return WEATHER_IMAGE_SIZE + _line_height(_font(400, _rem(1))) + _line_height(_font(700, _rem(1.25)))
+
+    def _draw_weather(self, image: Image.Image, draw: ImageDraw.ImageDraw, weather_forecast: ForecastDay, bottom: int) -> None:
+        # Forecast may come without hours left for today
+        if not weather_forecast.hours:
+            return
+
+        hour_font = _font(400, _rem(1))
+        temperature_font = _font(700, _rem(1.25))
+        top = bottom - self._get_weather_height()
+        width = TODAY_WIDTH / len(weather_forecast.hours)
+
+        for index, hour in enumerate(weather_forecast.hours):
+            center = TODAY_PADDING + width * index + width / 2
+            icon = _weather_icon(f"{STATIC_PATH}/images/weather/{hour.icon}", WEATHER_IMAGE_SIZE)
+            image.paste(icon, (round(center - WEATHER_IMAGE_SIZE / 2), top), icon)
+
+            y = top + WEATHER_IMAGE_SIZE
+            draw.text((center, _baseline(hour_font, y)), hour.hour, font=hour_font, fill=GRAY, anchor="ms")
+            y += _line_height(hour_font)
+            draw.text((center, _baseline(temperature_font, y)), f"{hour.temperature}°C", font=temperature_font, fill=BLACK, anchor="ms")
+
+    def _get_preview_month_height(self, month: Month) -> int:
+        rows = 1 + len(month.days) // 7
+        return max(PREVIEW_DAYS_MIN_HEIGHT, rows * PREVIEW_DAY_HEIGHT)
+
+    def _draw_preview_month(self, image: Image.Image, draw: ImageDraw.ImageDraw, month: Month, left: float, top: int, height: int) -> None:
+        font = _font(400, _rem(1))
+        day_name_font = _font(400, _rem(0.9))
+        today_font = _font(700, _rem(1))
+
+        # Month name is written vertically, from bottom to top
+        name = f"{self.config.i18n.preview_months[month.number - 1]} {month.year}"
+        name_height = _line_height(font)
+        name_mask = Image.new("L", (round(font.getlength(name)) + 1, name_height), 0)
+        ImageDraw.Draw(name_mask).text((0, _baseline(font, 0)), name, font=font, fill=255, anchor="ls")
+        name_mask = name_mask.rotate(90, expand=True)
+        name_bottom = top + height - PREVIEW_MONTH_NAME_MARGIN_BOTTOM
+        image.paste(BLACK, (round(left), name_bottom - name_mask.size[1]), name_mask)
+
+        days_left = left + name_height + PREVIEW_MONTH_NAME_MARGIN
+        day_width = (left + PREVIEW_MONTH_WIDTH - days_left) / 7
+
+        for index, day_name in enumerate(self.config.i18n.week_days):
+            center = days_left + day_width * index + day_width / 2
+            draw.text((center, _baseline(day_name_font, top, PREVIEW_DAY_HEIGHT)), day_name, font=day_name_font, fill=GRAY, anchor="ms")
+
+        for index, day in enumerate(month.days):
+            center = days_left + day_width * (index % 7) + day_width / 2
+            row_top = top + PREVIEW_DAY_HEIGHT * (index // 7 + 1)
+            day_font = font
+            color = BLACK if day.is_current_month else GRAY
+            if day.is_today:
+                self._draw_circle(image, center, row_top + PREVIEW_DAY_HEIGHT / 2, PREVIEW_TODAY_RADIUS, (day_width, PREVIEW_DAY_HEIGHT))
+                day_font = today_font
+                color = WHITE
+            draw.text((center, _baseline(day_font, row_top, PREVIEW_DAY_HEIGHT)), str(day.number), font=day_font, fill=color, anchor="ms")
+
+    def _draw_circle(self, image: Image.Image, x: float, y: float, radius: float, clip: Tuple[float, float]) -> None:
+        # Draws red circle clipped to the background box of the element, like radial-gradient does
+        width, height = round(clip[0]), round(clip[1])
+        mask = Image.new("L", (width * ICONS_SUPERSAMPLING, height * ICONS_SUPERSAMPLING), 0)
+        center_x, center_y = width * ICONS_SUPERSAMPLING / 2, height * ICONS_SUPERSAMPLING / 2
+        scaled_radius = radius * ICONS_SUPERSAMPLING
+        ImageDraw.Draw(mask).ellipse(
+            (center_x - scaled_radius, center_y - scaled_radius, center_x + scaled_radius, center_y + scaled_radius),
+            fill=255,
+        )
+        mask = mask.resize((width, height), Image.LANCZOS)
+        image.paste(RED, (round(x - width / 2), round(y - height / 2)), mask)
+
+    def _draw_status_icons(self, image: Image.Image, calendar: Calendar, battery_status: BatteryStatus = None) -> None:
+        battery_icon = self._get_battery_icon(battery_status)
+        if battery_icon:
+            icon = self._draw_battery_icon(battery_icon)
+            image.paste(icon, (self.config.image_width - BATTERY_RIGHT - icon.size[0], BATTERY_TOP), icon)
+        if calendar.offline_events:
+            icon = self._draw_no_wifi_icon()
+            top = NO_WIFI_BELOW_BATTERY_TOP if battery_icon else NO_WIFI_TOP
+            image.paste(icon, (self.config.image_width - NO_WIFI_RIGHT - icon.size[0], top), icon)
+
+    def _draw_battery_icon(self, name: str) -> Image.Image:
+        # Shapes follow static/images/battery-*.svg (576x512 view box)
+        scale = BATTERY_WIDTH * ICONS_SUPERSAMPLING / 576
+        icon = Image.new("RGBA", (round(576 * scale), round(512 * scale)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(icon)
+        color = LIGHT_RED if name == "empty" else GRAY_DARK
+
+        def box(x1, y1, x2, y2):
+            return x1 * scale, y1 * scale, x2 * scale, y2 * scale
+
+        draw.rounded_rectangle(box(0, 96, 544, 416), radius=80 * scale, fill=color)
+        draw.rounded_rectangle(box(64, 160, 480, 352), radius=16 * scale, fill=(0, 0, 0, 0))
+        draw.rounded_rectangle(box(512, 192, 576, 320), radius=32 * scale, fill=color)
+        levels = {"full": 448, "three-quarters": 352, "half": 288, "quarter": 192}
+        if name in levels:
+            draw.rectangle(box(96, 192, levels[name], 320), fill=color)
+        if name == "charging":
+            bolt = [(338, 110), (166, 262), (248, 262), (198, 402), (376, 250), (296, 250)]
+            draw.rectangle(box(176, 96, 368, 160), fill=(0, 0, 0, 0))
+            draw.rectangle(box(176, 352, 368, 416), fill=(0, 0, 0, 0))
+            draw.polygon([(x * scale, y * scale) for x, y in bolt], fill=color)
+
+        return icon.resize((BATTERY_WIDTH, round(BATTERY_WIDTH * 512 / 576)), Image.LANCZOS)
+
+    def _draw_no_wifi_icon(self) -> Image.Image:
+        # Shapes follow static/images/no-wifi.svg (640x512 view box)
+        scale = NO_WIFI_WIDTH * ICONS_SUPERSAMPLING / 640
+        icon = Image.new("RGBA", (round(640 * scale), round(512 * scale)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(icon)
+
+        def box(x1, y1, x2, y2):
+            return x1 * scale, y1 * scale, x2 * scale, y2 * scale
+
+        for center, radius, start, end in ((431, 405, 219, 258), (481, 295, 229, 253)):
+            bounds = box(320 - radius, center - radius, 320 + radius, center + radius)
+            draw.arc(bounds, start, end, fill=LIGHT_RED, width=round(64 * scale))
+            draw.arc(bounds, 540 - end, 540 - start, fill=LIGHT_RED, width=round(64 * scale))
+        draw.rounded_rectangle(box(279, 24, 361, 320), radius=41 * scale, fill=LIGHT_RED)
+        draw.ellipse(box(256, 352, 384, 480), fill=LIGHT_RED)
+
+        return icon.resize((NO_WIFI_WIDTH, round(NO_WIFI_WIDTH * 512 / 640)), Image.LANCZOS)
+
+    def _draw_days(self, image: Image.Image, draw: ImageDraw.ImageDraw, calendar: Calendar, header_height: int) -> None:
+        day_name_font = _font(300, _rem(1.5))
+        left = DAYS_MARGIN
+        top = header_height + DAYS_MARGIN
+        cell_width = (self.config.image_width - 2 * DAYS_MARGIN) / 7
+
+        for index, day_name in enumerate(self.config.i18n.week_days):
+            center = left + cell_width * index + cell_width / 2
+            draw.text((center, _baseline(day_name_font, top + DAY_PADDING)), day_name, font=day_name_font, fill=GRAY, anchor="ms")
+        top += 2 * DAY_PADDING + _line_height(day_name_font)
+
+        days = list(calendar.days.values())
+        for week in range(1, self._calculate_maximum_number_of_weeks(calendar) + 1):
+            is_detailed_week = week <= self.config.detailed_weeks
+            week_days = days[7 * week - 7:7 * week]
+            week_height = max(self._get_day_height(day, is_detailed_week) for day in week_days)
+            for index, day in enumerate(week_days):
+                day_left = left + cell_width * index
+                if index < 6:
+                    draw.line((round(day_left + cell_width) - 1, top, round(day_left + cell_width) - 1, top + week_height - 1), fill=BLACK)
+                self._draw_day(image, draw, calendar, day, day_left, top, cell_width, is_detailed_week)
+            top += week_height
+
+    def _get_day_events(self, day: Day, is_detailed_week: bool) -> Tuple[list, int]:
+        more_events = len(day.events) - self.config.max_events_per_day
+        if not is_detailed_week and more_events > 0:
+            return day.events[0:self.config.max_events_per_day - 1], more_events + 1
+        return day.events, 0
+
+    def _get_day_height(self, day: Day, is_detailed_week: bool) -> int:
+        events, more_events = self._get_day_events(day, is_detailed_week)
+        number_height = DETAILED_DAY_NUMBER_HEIGHT if is_detailed_week else DAY_NUMBER_HEIGHT
+        event_height = DETAILED_EVENT_HEIGHT if is_detailed_week else EVENT_HEIGHT
+        lines = len(events) + (1 if more_events else 0)
+        events_height = max(self.config.max_events_per_day * EVENT_HEIGHT, lines * event_height)
+        return 2 * DAY_PADDING + number_height + events_height
+
+    def _draw_day(
+        self,
+        image: Image.Image,
+        draw: ImageDraw.ImageDraw,
+        calendar: Calendar,
+        day: Day,
+        left: float,
+        top: int,
+        width: float,
+        is_detailed_week: bool,
+    ) -> None:
+        is_past_day = day.datetime < calendar.today
+        is_today = day.datetime == calendar.today
+        center = left + width / 2
+        y = top + DAY_PADDING
+
+        number_height = DETAILED_DAY_NUMBER_HEIGHT if is_detailed_week else DAY_NUMBER_HEIGHT
+        number_line_height = DETAILED_DAY_NUMBER_LINE_HEIGHT if is_detailed_week else DAY_NUMBER_LINE_HEIGHT
+        number_font = _font(400, _rem(2) if is_detailed_week else _rem(1.3))
+        number_color = GRAY if is_past_day else BLACK
+        if is_today:
+            self._draw_circle(image, center, y + number_height / 2, DAY_TODAY_RADIUS, (DAY_NUMBER_WIDTH, number_height))
+            number_font = _font(700, _rem(2) if is_detailed_week else _rem(1.3))
+            number_color = WHITE
+        draw.text((center, _baseline(number_font, y, number_line_height)), str(day.number), font=number_font, fill=number_color, anchor="ms")
+        y += number_height
+
+        event_height = DETAILED_EVENT_HEIGHT if is_detailed_week else EVENT_HEIGHT
+        event_width = (self.config.image_width - 2 * DAYS_MARGIN - 60) / 7 - 2 * DAY_PADDING
+        font_size = _rem(1.2) if is_detailed_week else _rem(1)
+        summary_font = _font(400, font_size)
+        bold_font = _font(900, font_size)
+        x = left + DAY_PADDING
+
+        events, more_events = self._get_day_events(day, is_detailed_week)
+        for event in events:
+            parts = []
+            if not event.all_day:
+                parts.append((f"{event.start_time} ", bold_font))
+            parts.append((event.summary, summary_font))
+            colors = [GRAY if is_past_day else BLACK] * len(parts)
+            if event.important and not is_past_day:
+                colors[-1] = RED
+            self._draw_spans(draw, x, _baseline(summary_font, y), _ellipsize(parts, event_width), colors)
+            y += event_height
+
+        if more_events:
+            parts = [("...", summary_font), (f"+{more_events}", bold_font)]
+            self._draw_spans(draw, x, _baseline(summary_font, y), parts, [BLACK, BLACK])
+
+    def _draw_spans(self, draw: ImageDraw.ImageDraw, x: float, baseline: float, parts: list, colors: list) -> None:
+        for (text, font), color in zip(parts, colors):
+            draw.text((x, baseline), text, font=font, fill=color, anchor="ls")
+            x += font.getlength(text)
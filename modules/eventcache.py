@@ -0,0 +1,99 @@
+import logging
+import os
+import struct
+import zlib
+
+from datetime import datetime, tzinfo
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger('eventcache')
+
+
+# File layout, all numbers little endian:
+#   header:  magic, format version, number of days
+#   index:   for every day its date ordinal, offset of its first event and number of events
+#   events:  flags, start and end as UTC timestamps, start time and summary as length prefixed UTF-8
+#   trailer: CRC-32 of everything before it, a file cut short by power loss doesn't pass the check
+MAGIC = b"MKEV"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")
+DAY = struct.Struct("<iII")
+EVENT = struct.Struct("<BqqBI")
+TRAILER = struct.Struct("<I")
+
+ALL_DAY = 1
+IMPORTANT = 2
+
+# all_day, end_date, important, start_date, start_time, summary
+CachedEvent = Tuple[bool, datetime, bool, datetime, Optional[str], str]
+
+
+def save_days(path: str, days: Iterable[Tuple[int, Iterable]]) -> None:
+    # Saves events of days given as (date ordinal, events), events need the attributes named in CachedEvent
+    index = []
+    events = bytearray()
+    for ordinal, day_events in days:
+        offset = len(events)
+        count = 0
+        for event in day_events:
+            start_time = (event.start_time or "").encode("utf-8")
+            summary = event.summary.encode("utf-8")
+            flags = (ALL_DAY if event.all_day else 0) | (IMPORTANT if event.important else 0)
+            events += EVENT.pack(
+                flags, int(event.start_date.timestamp()), int(event.end_date.timestamp()), len(start_time), len(summary)
+            )
+            events += start_time
+            events += summary
+            count += 1
+        index.append(DAY.pack(ordinal, offset, count))
+
+    data = HEADER.pack(MAGIC, VERSION, len(index)) + b"".join(index) + events
+    data += TRAILER.pack(zlib.crc32(data))
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as cache_file:
+        cache_file.write(data)
+        cache_file.flush()
+        os.fsync(cache_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_days(path: str, ordinals: Iterable[int], timezone: tzinfo) -> Dict[int, List[CachedEvent]]:
+    # Returns events of requested days found in the cache, events of other days aren't decoded.
+    # Raises ValueError when the file is damaged or has another format.
+    with open(path, "rb") as cache_file:
+        data = memoryview(cache_file.read())
+    if len(data) < HEADER.size + TRAILER.size:
+        raise ValueError("Event cache is truncated")
+    (checksum,) = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+    if zlib.crc32(data[:-TRAILER.size]) != checksum:
+        raise ValueError("Event cache is damaged")
+    magic, version, number_of_days = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported event cache version {version}")
+
+    events_start = HEADER.size + number_of_days * DAY.size
+    wanted = set(ordinals)
+    days = {}
+    for ordinal, offset, count in DAY.iter_unpack(data[HEADER.size:events_start]):
+        if ordinal not in wanted:
+            continue
+        position = events_start + offset
+        day_events = []
+        for _ in range(count):
+            flags, start, end, start_time_length, summary_length = EVENT.unpack_from(data, position)
+            position += EVENT.size
+            start_time = str(data[position:position + start_time_length], "utf-8") or None
+            position += start_time_length
+            summary = str(data[position:position + summary_length], "utf-8")
+            position += summary_length
+            day_events.append((
+                bool(flags & ALL_DAY),
+                datetime.fromtimestamp(end, timezone),
+                bool(flags & IMPORTANT),
+                datetime.fromtimestamp(start, timezone),
+                start_time,
+                summary,
+            ))
+        days[ordinal] = day_events
+    return days
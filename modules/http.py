@@ -0,0 +1,55 @@
+import logging
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+
+logger = logging.getLogger('http')
+
+
+# Connect and read timeouts in seconds, a slow server must not keep the device awake
+TIMEOUT = (5, 30)
+# Connections kept alive per host, enough for all calendars fetched at once
+POOL_SIZE = 8
+# Failed connections and 5xx answers are retried, waiting 0.5s and 1s in between
+RETRIES = Retry(
+    total=2,
+    connect=2,
+    read=1,
+    status=2,
+    backoff_factor=0.5,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=("GET", "HEAD"),
+    raise_on_status=False,
+)
+# Connectivity check has to answer quickly, a failed attempt isn't repeated
+NO_RETRIES = Retry(total=0, read=False)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class Session(requests.Session):
+    # Session with keep-alive connection pools, retries and compression, requests without timeout get TIMEOUT
+    def __init__(self, retries: Retry = RETRIES):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        # gzip and deflate, br too when brotli is installed
+        self.headers.update(make_headers(accept_encoding=True))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> Session:
+    # Session shared by everything talking to the internet, so connections to the same host are reused
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
@@ -0,0 +1,340 @@
+import io
+import logging
+import math
+import re
+
+from datetime import datetime, timedelta, tzinfo
+from dateutil import rrule, tz
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger('ical')
+
+
+# Properties of VEVENT the calendar uses, everything else is skipped without parsing
+EVENT_PROPERTIES = (
+    "DTSTART",
+    "DTEND",
+    "DURATION",
+    "EXDATE",
+    "EXRULE",
+    "LAST-MODIFIED",
+    "RDATE",
+    "RECURRENCE-ID",
+    "RRULE",
+    "SEQUENCE",
+    "SUMMARY",
+    "UID",
+)
+RECURRENCE_PROPERTIES = ("RRULE", "RDATE", "EXRULE", "EXDATE")
+DURATION_PATTERN = re.compile(r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+TEXT_ESCAPES = {"\\n": "\n", "\\N": "\n", "\\,": ",", "\\;": ";", "\\\\": "\\"}
+NAME_PATTERN = re.compile(r"[^:;]*")
+TEXT_ESCAPE_PATTERN = re.compile(r"\\[nN,;\\]")
+# Rules repeating with these frequencies have a fixed period in local time, so DTSTART can be moved
+# forward by whole periods without changing the occurrences
+FIXED_PERIOD_DAYS = {"DAILY": 1, "WEEKLY": 7}
+
+
+class Property:
+    __slots__ = ("name", "params", "value")
+
+    def __init__(self, name: str, params: Dict[str, str], value: str):
+        self.name = name
+        self.params = params
+        self.value = value
+
+    def line(self) -> str:
+        params = "".join(f";{name}={value}" for name, value in self.params.items())
+        return f"{self.name}{params}:{self.value}"
+
+
+# Properties of a VEVENT by name
+Component = Dict[str, List[Property]]
+
+
+class VEvent:
+    # Raw VEVENT with only the properties the calendar uses, times are resolved to aware datetimes
+    # Floating events (all-day ones included) are in calendar time zone, so recurrences have to be
+    # expanded in local time
+    __slots__ = ("all_day", "begin", "end", "floating", "properties", "recurrence")
+
+    def __init__(self, properties: Component, begin: datetime, end: datetime, all_day: bool,
+                 floating: bool = False):
+        self.properties = properties
+        self.begin = begin
+        self.end = end
+        self.all_day = all_day
+        self.floating = floating
+        self.recurrence = [prop for name in RECURRENCE_PROPERTIES for prop in properties.get(name, ())]
+
+    def get(self, name: str) -> Optional[str]:
+        values = self.properties.get(name)
+        return values[0].value if values else None
+
+    @property
+    def summary(self) -> str:
+        return unescape_text(self.get("SUMMARY") or "")
+
+    @property
+    def recurrence_rules(self) -> str:
+        # RRULE, RDATE, EXRULE and EXDATE lines in the form dateutil's rrulestr understands
+        return "\n".join(prop.line() for prop in self.recurrence)
+
+    @property
+    def duration(self) -> timedelta:
+        # Floating events last the same local time, even over a DST change
+        return self._local(self.end) - self._local(self.begin)
+
+    def get_occurrences(self, start: datetime, end: datetime, timezone: tzinfo) -> Tuple[List[datetime], Optional[datetime]]:
+        # Returns starts of occurrences that can overlap start..end and the first occurrence of all,
+        # both in the given timezone. Floating events are expanded in local time, so they keep their hour across DST.
+        duration = self.duration
+        first = next(iter(self._get_rules(self._local(self.begin))), None)
+        if first is None:
+            return [], None
+        # Window is widened by a day, so floating times don't have to be exact around DST changes
+        after = self._local((start - duration).astimezone(timezone)) - timedelta(days=1)
+        before = self._local(end.astimezone(timezone)) + timedelta(days=1)
+        rules = self._get_rules(self._get_start_before(after))
+        occurrences = [
+            occurrence
+            for occurrence in (self._to_timezone(moment, timezone) for moment in rules.between(after, before, inc=True))
+            if start <= occurrence + duration and occurrence < end
+        ]
+        return occurrences, self._to_timezone(first, timezone)
+
+    def _local(self, moment: datetime) -> datetime:
+        return moment.replace(tzinfo=None) if self.floating else moment
+
+    def _to_timezone(self, moment: datetime, timezone: tzinfo) -> datetime:
+        if not self.floating:
+            return moment.astimezone(timezone)
+        if hasattr(timezone, "localize"):
+            return timezone.localize(moment)
+        return moment.replace(tzinfo=timezone)
+
+    def _get_rules(self, dtstart: datetime) -> rrule.rruleset:
+        rules = rrule.rrulestr(self.recurrence_rules, dtstart=dtstart, forceset=True, ignoretz=self.floating)
+        if "RRULE" not in self.properties:
+            # Without RRULE nothing generates DTSTART, but it's still the first occurrence
+            rules.rdate(self._local(self.begin))
+        return rules
+
+    def _get_start_before(self, moment: datetime) -> datetime:
+        # Latest DTSTART before moment generating the same occurrences from there on. Rules with COUNT
+        # or without a fixed period have to be expanded from the original DTSTART.
+        begin = self._local(self.begin)
+        period = 1
+        for prop in self.recurrence:
+            if prop.name not in ("RRULE", "EXRULE"):
+                continue
+            parts = dict(part.partition("=")[::2] for part in prop.value.upper().split(";"))
+            if "COUNT" in parts or parts.get("FREQ") not in FIXED_PERIOD_DAYS:
+                return begin
+            period = _lcm(period, FIXED_PERIOD_DAYS[parts["FREQ"]] * int(parts.get("INTERVAL") or 1))
+        periods = (moment - begin).days // period - 1
+        if periods <= 0:
+            return begin
+        return begin + timedelta(days=periods * period)
+
+
+def read_components(lines: Iterable[str], timezone: tzinfo) -> Iterator[Tuple[Component, "TimezoneResolver"]]:
+    # Yields properties of every VEVENT with time zones defined so far, so callers can skip building the event.
+    # Lines are consumed one by one, so only the event being read and time zone definitions are kept in memory.
+    # Only lines that are used get fully parsed.
+    timezones = TimezoneResolver(timezone)
+    components = []
+    event = None
+    for line in unfold(lines):
+        name = NAME_PATTERN.match(line).group(0).upper()
+        if name not in ("BEGIN", "END"):
+            if timezones.reading:
+                timezones.add_line(line)
+            elif event is not None and name in EVENT_PROPERTIES and components[-1] == "VEVENT":
+                event.setdefault(name, []).append(Property(*parse_line(line)))
+            continue
+        value = parse_line(line)[2].upper()
+        if name == "BEGIN":
+            components.append(value)
+            if components[-2:] in (["VEVENT"], ["VCALENDAR", "VEVENT"]):
+                event = {}
+            elif value == "VTIMEZONE":
+                timezones.begin_definition()
+        if timezones.reading:
+            timezones.add_line(line)
+        if name == "END":
+            component = components.pop() if components else None
+            if component == "VEVENT" and event is not None and components in ([], ["VCALENDAR"]):
+                yield event, timezones
+                event = None
+            elif component == "VTIMEZONE":
+                timezones.end_definition()
+
+
+def get_component_key(component: Component) -> Optional[str]:
+    # Identifies a version of an event, None when the feed doesn't say when the event changes
+    uid = _get_value(component, "UID")
+    sequence = _get_value(component, "SEQUENCE")
+    last_modified = _get_value(component, "LAST-MODIFIED")
+    if not uid or (sequence is None and last_modified is None):
+        return None
+    return "\x1f".join((uid, _get_value(component, "RECURRENCE-ID") or "", sequence or "", last_modified or ""))
+
+
+def unfold(lines: Iterable[str]) -> Iterator[str]:
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_line(line: str) -> Tuple[str, Dict[str, str], str]:
+    # NAME;PARAM=VALUE;PARAM="QUOTED:VALUE":PROPERTY VALUE
+    quoted = False
+    separator = len(line)
+    for index, character in enumerate(line):
+        if character == '"':
+            quoted = not quoted
+        elif character == ":" and not quoted:
+            separator = index
+            break
+    head, value = line[:separator], line[separator + 1:]
+    name, *raw_params = head.split(";")
+    params = {}
+    for param in raw_params:
+        param_name, _, param_value = param.partition("=")
+        params[param_name.upper()] = param_value
+    return name.upper(), params, value
+
+
+def parse_duration(value: str) -> timedelta:
+    match = DURATION_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(
+        weeks=int(weeks or 0),
+        days=int(days or 0),
+        hours=int(hours or 0),
+        minutes=int(minutes or 0),
+        seconds=int(seconds or 0),
+    )
+    return -duration if sign == "-" else duration
+
+
+def unescape_text(value: str) -> str:
+    return TEXT_ESCAPE_PATTERN.sub(lambda match: TEXT_ESCAPES[match.group(0)], value)
+
+
+class TimezoneResolver:
+    # Resolves TZID parameters, IANA names first and VTIMEZONE definitions from the feed for the rest
+    def __init__(self, default: tzinfo):
+        self.default = default
+        self.definitions = []
+        self.reading = False
+        self.cache = {}
+        self.vtimezones = None
+
+    def begin_definition(self) -> None:
+        self.reading = True
+
+    def add_line(self, line: str) -> None:
+        self.definitions.append(line)
+
+    def end_definition(self) -> None:
+        self.reading = False
+        self.vtimezones = None
+
+    def get(self, tzid: Optional[str]) -> tzinfo:
+        if not tzid:
+            return self.default
+        tzid = tzid.strip('"')
+        if tzid not in self.cache:
+            self.cache[tzid] = tz.gettz(tzid.lstrip("/")) or self._get_defined(tzid)
+        return self.cache[tzid]
+
+    def _get_defined(self, tzid: str) -> tzinfo:
+        if self.vtimezones is None:
+            try:
+                self.vtimezones = tz.tzical(io.StringIO("\n".join(self.definitions))) if self.definitions else None
+            except ValueError:
+                logger.warning("Invalid VTIMEZONE definitions", exc_info=True)
+                self.vtimezones = None
+        if self.vtimezones is not None:
+            try:
+                return self.vtimezones.get(tzid)
+            except (KeyError, ValueError):
+                pass
+        logger.warning(f"Unknown time zone {tzid}, using calendar time zone")
+        return self.default
+
+    def parse(self, prop: Property) -> Tuple[datetime, Optional[tzinfo], bool]:
+        # Returns naive datetime, its time zone (None for floating times and dates) and whether the value is a date
+        value = prop.value.strip()
+        if prop.params.get("VALUE") == "DATE" or len(value) == 8:
+            return datetime.strptime(value[:8], "%Y%m%d"), None, True
+        moment = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+        if value.endswith("Z"):
+            return moment, tz.UTC, False
+        if "TZID" in prop.params:
+            return moment, self.get(prop.params["TZID"]), False
+        return moment, None, False
+
+    def localize(self, moment: datetime, timezone: Optional[tzinfo]) -> datetime:
+        # pytz zones need localize, other tzinfo implementations work with replace
+        timezone = timezone or self.default
+        if hasattr(timezone, "localize"):
+            return timezone.localize(moment)
+        return moment.replace(tzinfo=timezone)
+
+
+def build_event(component: Component, timezones: TimezoneResolver) -> Optional[VEvent]:
+    if "DTSTART" not in component:
+        return None
+    try:
+        begin, begin_timezone, all_day = timezones.parse(component["DTSTART"][0])
+        if "DTEND" in component:
+            end, end_timezone, _ = timezones.parse(component["DTEND"][0])
+        else:
+            end, end_timezone = begin, begin_timezone
+            if "DURATION" in component:
+                end = begin + parse_duration(component["DURATION"][0].value)
+            elif all_day:
+                end = begin + timedelta(days=1)
+    except ValueError:
+        logger.warning(f"Skipping event with invalid dates: {_get_value(component, 'UID')}", exc_info=True)
+        return None
+    return VEvent(
+        component,
+        timezones.localize(begin, begin_timezone),
+        timezones.localize(end, end_timezone),
+        all_day,
+        floating=begin_timezone is None,
+    )
+
+
+def _get_value(component: Component, name: str) -> Optional[str]:
+    values = component.get(name)
+    return values[0].value if values else None
+
+
+def _lcm(a: int, b: int) -> int:
+    return a * b // math.gcd(a, b)
+
+
+def can_overlap(event: VEvent, start: datetime, end: datetime) -> bool:
+    if event.begin >= end:
+        return False
+    if event.recurrence:
+        return True
+    return event.end >= start
+
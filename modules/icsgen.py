@@ -0,0 +1,155 @@
+import random
+
+from datetime import date, datetime, timedelta
+from typing import Iterator, Sequence
+
+
+# Time zones used by generated events, each gets its VTIMEZONE definition in the feed
+TIMEZONES = ("Europe/Warsaw", "America/New_York", "Asia/Tokyo")
+# Simplified VTIMEZONE definitions (name: standard offset, daylight offset, DST start month, DST end month)
+TIMEZONE_DEFINITIONS = {
+    "Europe/Warsaw": ("+0100", "+0200", 3, 10),
+    "America/New_York": ("-0500", "-0400", 3, 11),
+    "Asia/Tokyo": ("+0900", None, None, None),
+}
+WEEK_DAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+
+def generate_feed(
+    single_events: int = 2000,
+    recurring_events: int = 200,
+    all_day_events: int = 200,
+    exdates: int = 5,
+    history_days: int = 5 * 365,
+    future_days: int = 90,
+    timezones: Sequence[str] = TIMEZONES,
+    today: date = None,
+    seed: int = 0,
+) -> str:
+    # Returns ICS feed shaped like long lived calendars: single events scattered over history_days
+    # before and future_days after today, daily and weekly rules started years ago with EXDATEs,
+    # multi-day all-day events and events in several time zones. Same arguments give the same feed.
+    return "\r\n".join(_generate_lines(
+        random.Random(seed),
+        single_events,
+        recurring_events,
+        all_day_events,
+        exdates,
+        history_days,
+        future_days,
+        timezones,
+        today or date.today(),
+    )) + "\r\n"
+
+
+def _generate_lines(generator: random.Random, single_events: int, recurring_events: int, all_day_events: int,
+                    exdates: int, history_days: int, future_days: int, timezones: Sequence[str],
+                    today: date) -> Iterator[str]:
+    yield "BEGIN:VCALENDAR"
+    yield "VERSION:2.0"
+    yield "PRODID:-//MagInkCal//Synthetic feed//EN"
+    for tzid in timezones:
+        yield from _generate_timezone(tzid)
+
+    def random_start() -> datetime:
+        day = today + timedelta(days=generator.randint(-history_days, future_days))
+        return datetime(day.year, day.month, day.day, generator.randint(6, 21), generator.choice((0, 15, 30, 45)))
+
+    def time_property(name: str, moment: datetime, tzid: str) -> str:
+        if tzid == "UTC":
+            return f"{name}:{moment:%Y%m%dT%H%M%S}Z"
+        if tzid:
+            return f"{name};TZID={tzid}:{moment:%Y%m%dT%H%M%S}"
+        return f"{name}:{moment:%Y%m%dT%H%M%S}"
+
+    zones = (None, "UTC") + tuple(timezones)
+    uid = 0
+    for _ in range(single_events):
+        uid += 1
+        start = random_start()
+        tzid = generator.choice(zones)
+        yield from _generate_event(generator, uid, f"Meeting {uid}", (
+            time_property("DTSTART", start, tzid),
+            time_property("DTEND", start + timedelta(minutes=generator.choice((15, 30, 60, 90, 180))), tzid),
+        ))
+
+    for _ in range(recurring_events):
+        uid += 1
+        start = random_start()
+        tzid = generator.choice(zones)
+        if generator.random() < 0.5:
+            rule = f"FREQ=DAILY;INTERVAL={generator.choice((1, 1, 2))}"
+            step = timedelta(days=1)
+        else:
+            days = generator.sample(WEEK_DAYS[:5], generator.randint(1, 3))
+            rule = f"FREQ=WEEKLY;BYDAY={','.join(days)}"
+            step = timedelta(weeks=1)
+        if generator.random() < 0.2:
+            rule += f";UNTIL={today + timedelta(days=generator.randint(-30, future_days)):%Y%m%d}T235959Z"
+        properties = [
+            time_property("DTSTART", start, tzid),
+            time_property("DTEND", start + timedelta(minutes=generator.choice((15, 30, 60))), tzid),
+            f"RRULE:{rule}",
+        ]
+        # Skipped occurrences fall on dates the rule produces, most of them close to today
+        for _ in range(exdates):
+            skipped = start + step * max(0, (today - start.date()).days // step.days + generator.randint(-20, 10))
+            properties.append(time_property("EXDATE", skipped, tzid))
+        yield from _generate_event(generator, uid, f"Recurring {uid}", properties)
+
+    for _ in range(all_day_events):
+        uid += 1
+        start = random_start().date()
+        yield from _generate_event(generator, uid, f"Trip {uid}", (
+            f"DTSTART;VALUE=DATE:{start:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{start + timedelta(days=generator.randint(1, 10)):%Y%m%d}",
+        ))
+    yield "END:VCALENDAR"
+
+
+def _generate_event(generator: random.Random, uid: int, summary: str, properties: Sequence[str]) -> Iterator[str]:
+    # Properties the calendar doesn't use are there too, real feeds are full of them
+    yield "BEGIN:VEVENT"
+    yield "DTSTAMP:20240101T000000Z"
+    yield f"UID:{uid:08d}@maginkcal.invalid"
+    yield f"SEQUENCE:{generator.randint(0, 3)}"
+    yield f"LAST-MODIFIED:2024{generator.randint(1, 12):02d}{generator.randint(1, 28):02d}T120000Z"
+    yield f"SUMMARY:{summary}"
+    yield from properties
+    description = "Agenda\\, notes and a link https://example.invalid/meeting " * generator.randint(0, 6)
+    yield from _fold(f"DESCRIPTION:{description}")
+    yield "STATUS:CONFIRMED"
+    yield "BEGIN:VALARM"
+    yield "ACTION:DISPLAY"
+    yield "DESCRIPTION:Reminder"
+    yield "TRIGGER:-PT10M"
+    yield "END:VALARM"
+    yield "END:VEVENT"
+
+
+def _generate_timezone(tzid: str) -> Iterator[str]:
+    standard, daylight, daylight_start, daylight_end = TIMEZONE_DEFINITIONS.get(tzid, ("+0000", None, None, None))
+    yield "BEGIN:VTIMEZONE"
+    yield f"TZID:{tzid}"
+    if daylight:
+        yield "BEGIN:DAYLIGHT"
+        yield f"TZOFFSETFROM:{standard}"
+        yield f"TZOFFSETTO:{daylight}"
+        yield "DTSTART:19700329T020000"
+        yield f"RRULE:FREQ=YEARLY;BYMONTH={daylight_start};BYDAY=-1SU"
+        yield "END:DAYLIGHT"
+    yield "BEGIN:STANDARD"
+    yield f"TZOFFSETFROM:{daylight or standard}"
+    yield f"TZOFFSETTO:{standard}"
+    yield "DTSTART:19701025T030000"
+    if daylight:
+        yield f"RRULE:FREQ=YEARLY;BYMONTH={daylight_end};BYDAY=-1SU"
+    yield "END:STANDARD"
+    yield "END:VTIMEZONE"
+
+
+def _fold(line: str) -> Iterator[str]:
+    # Lines longer than 75 characters continue on lines starting with a space
+    yield line[:75]
+    for index in range(75, len(line), 74):
+        yield " " + line[index:index + 74]
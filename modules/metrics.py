@@ -0,0 +1,129 @@
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+
+logger = logging.getLogger('metrics')
+
+
+METRICS_PATH = f"{pathlib.Path(__file__).parent.parent.absolute()}/logs/metrics.jsonl"
+# Metrics file rotates like the log, previous runs are kept in metrics.jsonl.1
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+OPENMETRICS_PREFIX = "maginkcal"
+
+
+class Run:
+    # Spans and values measured during one wakeup, shared by all threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[dict] = []
+        self.values: Dict[str, float] = {}
+
+    def add_span(self, name: str, start: float, duration: float, attributes: dict) -> None:
+        span = {"name": name, "start": round(start - self.start, 6), "duration": round(duration, 6)}
+        if attributes:
+            span["attributes"] = attributes
+        with self.lock:
+            self.spans.append(span)
+
+    def set_value(self, name: str, value: float) -> None:
+        with self.lock:
+            self.values[name] = value
+
+    def get_record(self, status: str) -> dict:
+        # Durations of spans with the same name are summed up, so stages repeated per calendar are comparable
+        with self.lock:
+            stages = {}
+            for span in self.spans:
+                stages[span["name"]] = round(stages.get(span["name"], 0.0) + span["duration"], 6)
+            return {
+                "time": datetime.fromtimestamp(self.started_at).astimezone().isoformat(timespec="seconds"),
+                "status": status,
+                "duration": round(time.perf_counter() - self.start, 6),
+                "stages": stages,
+                "values": dict(self.values),
+                "spans": list(self.spans),
+            }
+
+
+_run = Run()
+
+
+def start_run() -> None:
+    # Forgets everything measured so far, measurements start from now
+    global _run
+    _run = Run()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    # Measures the block, spans are recorded even when it raises
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _run.add_span(name, start, time.perf_counter() - start, attributes)
+
+
+def set_value(name: str, value: float) -> None:
+    # Records a measured value, e.g. number of bytes or events, the last one set wins
+    _run.set_value(name, value)
+
+
+def finish_run(status: str = "ok", textfile_path: Optional[str] = None, path: str = METRICS_PATH) -> dict:
+    # Appends record of the run to the metrics file and optionally writes it for node_exporter's textfile collector
+    record = _run.get_record(status)
+    try:
+        if os.path.exists(path) and os.path.getsize(path) > METRICS_MAX_BYTES:
+            os.replace(path, f"{path}.1")
+        with open(path, "a") as metrics_file:
+            metrics_file.write(json.dumps(record) + "\n")
+        if textfile_path:
+            _write_openmetrics(textfile_path, record)
+    except OSError:
+        logger.warning("Failed to save metrics", exc_info=True)
+    return record
+
+
+def read_records(path: str = METRICS_PATH) -> List[dict]:
+    records = []
+    for file_path in (f"{path}.1", path):
+        try:
+            with open(file_path) as metrics_file:
+                for line in metrics_file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Line cut short by power loss
+                        continue
+        except OSError:
+            continue
+    return records
+
+
+def _write_openmetrics(path: str, record: dict) -> None:
+    lines = [
+        f"# TYPE {OPENMETRICS_PREFIX}_run_duration_seconds gauge",
+        f'{OPENMETRICS_PREFIX}_run_duration_seconds{{status="{record["status"]}"}} {record["duration"]}',
+        f"# TYPE {OPENMETRICS_PREFIX}_stage_duration_seconds gauge",
+    ]
+    for name, duration in sorted(record["stages"].items()):
+        lines.append(f'{OPENMETRICS_PREFIX}_stage_duration_seconds{{stage="{name}"}} {duration}')
+    lines.append(f"# TYPE {OPENMETRICS_PREFIX}_value gauge")
+    for name, value in sorted(record["values"].items()):
+        lines.append(f'{OPENMETRICS_PREFIX}_value{{name="{name}"}} {value}')
+    lines.append(f"# TYPE {OPENMETRICS_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{OPENMETRICS_PREFIX}_last_run_timestamp_seconds {int(time.time())}")
+    lines.append("# EOF")
+    with open(f"{path}.tmp", "w") as textfile:
+        textfile.write("\n".join(lines) + "\n")
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,44 @@
+import logging
+
+from PIL import Image, ImageChops
+from typing import Tuple
+
+
+logger = logging.getLogger('planes')
+
+
+# Same weights Pillow uses when dithering RGB directly to mode "1" (truncated ITU-R 601-2 luma),
+# so converting the single channel black plane gives exactly the same bits as converting the RGB image
+LUMA_MATRIX = (0.299, 0.587, 0.114, -0.4995)
+
+
+def split_planes(image: Image.Image, red_threshold: int = 0, black_threshold: int = 0) -> Tuple[Image.Image, Image.Image]:
+    # Returns single channel (mode "L") black and red planes of the rendered image, 0 means black or red ink.
+    # Pixel is drawn red when its red channel exceeds the darker of green and blue by more than red_threshold.
+    # Pixel is removed from the black plane when its red channel exceeds the lighter of green and blue
+    # by more than black_threshold, otherwise it keeps its grayscale value.
+    image = image.convert("RGB")
+    red, green, blue = image.split()
+
+    redness = ImageChops.subtract(red, ImageChops.darker(green, blue))
+    red_plane = redness.point(lambda value: 0 if value > red_threshold else 255)
+
+    dominant_red = ImageChops.subtract(red, ImageChops.lighter(green, blue))
+    red_mask = dominant_red.point(lambda value: 255 if value > black_threshold else 0)
+    black_plane = ImageChops.lighter(image.convert("L", LUMA_MATRIX), red_mask)
+
+    return black_plane, red_plane
+
+
+def pack_plane(plane: Image.Image, rotate: int = 0, invert: bool = False) -> bytes:
+    # Packs single channel plane to 1 bit per pixel, rows of MSB first bytes, the way display controllers expect.
+    # Rotation happens before dithering, the same way it did when the driver received rotated RGB images.
+    plane = plane.rotate(rotate, expand=True)
+    if invert:
+        plane = ImageChops.invert(plane)
+    return plane.convert("1").tobytes()
+
+
+def pack_planes(black_plane: Image.Image, red_plane: Image.Image, rotate: int = 0) -> Tuple[bytes, bytes]:
+    # Black buffer has bits set for white pixels, red buffer has bits set for red pixels
+    return pack_plane(black_plane, rotate), pack_plane(red_plane, rotate, invert=True)
@@ -1,16 +1,22 @@
+import hashlib
+import io
+import json
 import logging
+import os
 import pathlib
 
+from abc import ABC, abstractmethod
 from jinja2 import Environment, FileSystemLoader
+from modules import metrics
+from modules.assets import AssetBundle, get_text
 from modules.calendar import Calendar, get_months_preview
+from modules.chromium import Chromium
 from modules.config import Config
+from modules.planes import pack_planes, split_planes
 from modules.power import BatteryStatus
 from modules.weather import ForecastDay
 from PIL import Image
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from time import sleep
+from typing import Optional, Tuple
 
 
 logger = logging.getLogger('render')
@@ -24,86 +30,123 @@ DETAILED_WEEK_EVENT_HEIGHT = 28
 WEEK_MARGINS = 20
 MINIMUM_EVENTS_HEIGHT = 96
 
+# Fonts and images both renderers draw with
+ASSETS_PATH = f"{pathlib.Path(__file__).parent.parent.absolute()}/static"
+
+# Config fields that change what ends up on the screen
+FINGERPRINT_CONFIG_FIELDS = {
+    "black_plane_threshold",
+    "detailed_weeks",
+    "i18n",
+    "image_height",
+    "image_width",
+    "max_events_per_day",
+    "number_of_months",
+    "number_of_weeks",
+    "red_plane_threshold",
+    "renderer",
+    "rotate",
+    "screen_height",
+    "screen_width",
+}
+
+
+def get_renderer(config: Config) -> "Renderer":
+    if config.renderer == "pillow":
+        from modules.draw import PillowRenderer
+        return PillowRenderer(config)
+    return TemplateRenderer(config)
+
+
+class Renderer(ABC):
+    layout_path: str
 
-class TemplateRenderer:
     def __init__(self, config: Config):
         self.config = config
         self.workdir = f"{pathlib.Path(__file__).parent.parent.absolute()}/build"
-
-    def render(self, calendar: Calendar, battery_status: BatteryStatus = None, weather_forecast: ForecastDay = None):
-        self._build_html(calendar, battery_status, weather_forecast)
-
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--hide-scrollbars")
-        options.add_argument('--force-device-scale-factor=1')
-        driver = webdriver.Chrome(options=options)
-        self._set_driver_viewport_size(driver)
-        driver.get(f"file://{self.workdir}/calendar.html")
-        sleep(1)
-        image_path = f"{self.workdir}/calendar.png"
-        driver.get_screenshot_as_file(image_path)
-        driver.quit()
-
-        logger.info("Screenshot ready")
-
-        red_image = Image.open(image_path)
-        red_pixels = red_image.load()
-        black_image = Image.open(image_path)
-        black_pixels = black_image.load()
-
-        for i in range(red_image.size[0]):
-            for j in range(red_image.size[1]):
-                if red_pixels[i, j][0] <= red_pixels[i, j][1] and red_pixels[i, j][0] <= red_pixels[i, j][2]:
-                    red_pixels[i, j] = (255, 255, 255)
-                else:
-                    red_pixels[i, j] = (0, 0, 0)
-                if black_pixels[i, j][0] > black_pixels[i, j][1] and black_pixels[i, j][0] > black_pixels[i, j][2]:
-                    black_pixels[i, j] = (255, 255, 255)
-
-        red_image = red_image.rotate(self.config.rotate, expand=True)
-        black_image = black_image.rotate(self.config.rotate, expand=True)
-
-        # red_file = open(f"{self.workdir}/red.png", "wb")
-        # red_image.save(red_file)
-        # black_file = open(f"{self.workdir}/black.png", "wb")
-        # black_image.save(black_file)
-
-        logger.info("Image file rendered")
-
-        return black_image, red_image
-
-    def _build_html(self, calendar: Calendar, battery_status: BatteryStatus = None, weather_forecast: ForecastDay = None):
-        templates_path = f"{pathlib.Path(__file__).parent.parent.absolute()}/template"
-        environment = Environment(loader=FileSystemLoader(templates_path))
-        template = environment.get_template("calendar_template.jinja2")
-
-        battery_icon = None
+        self.fingerprint_path = f"{self.workdir}/fingerprint"
+
+    @abstractmethod
+    def render(
+        self,
+        calendar: Calendar,
+        battery_status: BatteryStatus = None,
+        weather_forecast: ForecastDay = None,
+    ) -> Tuple[bytes, bytes]:
+        # Returns black and red planes packed in display controller byte order
+        pass
+
+    def get_fingerprint(
+        self,
+        calendar: Calendar,
+        battery_status: BatteryStatus = None,
+        weather_forecast: ForecastDay = None,
+    ) -> str:
+        # Hash of everything the layout consumes, equal fingerprints mean identical frames
+        with open(self.layout_path, "rb") as layout_file:
+            layout_hash = hashlib.sha256(layout_file.read()).hexdigest()
+
+        content = {
+            "assets": self._get_assets_state(),
+            "battery_icon": self._get_battery_icon(battery_status),
+            "config": self.config.dict(include=FINGERPRINT_CONFIG_FIELDS),
+            "days": [day.dict() for day in calendar.days.values()],
+            "layout": layout_hash,
+            "no_wifi": calendar.offline_events,
+            "preview_months": [
+                {
+                    "number": month.number,
+                    "year": month.year,
+                    "days": [(day.number, day.is_current_month, day.is_today) for day in month.days],
+                }
+                for month in get_months_preview(self.config.number_of_months)
+            ],
+            "today": calendar.today,
+            "weather_forecast": weather_forecast.dict() if weather_forecast else None,
+        }
+        data = json.dumps(content, sort_keys=True, default=str)
+
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def is_displayed(self, fingerprint: str) -> bool:
+        try:
+            with open(self.fingerprint_path) as fingerprint_file:
+                return fingerprint_file.read().strip() == fingerprint
+        except OSError:
+            return False
+
+    def save_fingerprint(self, fingerprint: str) -> None:
+        with open(f"{self.fingerprint_path}.tmp", "w") as fingerprint_file:
+            fingerprint_file.write(fingerprint)
+        os.replace(f"{self.fingerprint_path}.tmp", self.fingerprint_path)
+        logger.info("Fingerprint of displayed frame saved")
+
+    def _get_assets_state(self) -> list:
+        # Paths, sizes and modification times of asset files, reading them all on every wakeup would cost more
+        # than rendering. git updates modification time of every file it changes.
+        state = []
+        for directory, _, file_names in os.walk(ASSETS_PATH):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                stat = os.stat(path)
+                state.append((os.path.relpath(path, ASSETS_PATH), stat.st_size, stat.st_mtime_ns))
+        return sorted(state)
+
+    def _pack_planes(self, image: Image.Image) -> Tuple[bytes, bytes]:
+        with metrics.span("render.split"):
+            black_plane, red_plane = split_planes(
+                image,
+                red_threshold=self.config.red_plane_threshold,
+                black_threshold=self.config.black_plane_threshold,
+            )
+
+        with metrics.span("render.pack"):
+            return pack_planes(black_plane, red_plane, self.config.rotate)
+
+    def _get_battery_icon(self, battery_status: BatteryStatus = None) -> Optional[str]:
         if battery_status and (battery_status.level is not None or battery_status.is_charging):
-            battery_icon = self._get_battery_icon_name(battery_status)
-
-        html = template.render(
-            calendar=calendar,
-            battery_icon=battery_icon,
-            detailed_weeks=self.config.detailed_weeks,
-            height=self.config.image_height,
-            i18n=self.config.i18n,
-            max_events_per_day=self.config.max_events_per_day,
-            month_number=int(calendar.today.strftime("%-m")),
-            no_wifi=calendar.offline_events,
-            number_of_weeks=self._calculate_maximum_number_of_weeks(calendar),
-            preview_months=get_months_preview(self.config.number_of_months),
-            width=self.config.image_width,
-            today=calendar.today,
-            today_day_number=int(calendar.today.strftime("%-d")),
-            weather_forecast=weather_forecast,
-        )
-
-        output_file = open(f"{self.workdir}/calendar.html", "w")
-        output_file.write(html)
-        output_file.close()
-
-        logger.info("HTML file rendered")
+            return self._get_battery_icon_name(battery_status)
+        return None
 
     def _get_battery_icon_name(self, battery_status: BatteryStatus) -> str:
         if battery_status.is_charging:
@@ -118,18 +161,6 @@ class TemplateRenderer:
             return "quarter"
         return "empty"
 
-    def _set_driver_viewport_size(self, driver):
-        current_window_size = driver.get_window_size()
-
-        html = driver.find_element(By.TAG_NAME, "html")
-        inner_width = int(html.get_attribute("clientWidth"))
-        inner_height = int(html.get_attribute("clientHeight"))
-
-        target_width = self.config.image_width + (current_window_size["width"] - inner_width)
-        target_height = self.config.image_height + (current_window_size["height"] - inner_height)
-
-        driver.set_window_rect(width=target_width, height=target_height)
-
     def _calculate_maximum_number_of_weeks(self, calendar: Calendar) -> int:
         days = list(calendar.days.values())
         space = CALENDAR_SPACE
@@ -152,3 +183,56 @@ class TemplateRenderer:
                 return max(1, week - 1)
 
         return self.config.number_of_weeks
+
+
+class TemplateRenderer(Renderer):
+    layout_path = f"{pathlib.Path(__file__).parent.parent.absolute()}/template/calendar_template.jinja2"
+
+    def render(self, calendar: Calendar, battery_status: BatteryStatus = None, weather_forecast: ForecastDay = None):
+        with metrics.span("render.html"):
+            html = self._build_html(calendar, battery_status, weather_forecast)
+
+        with Chromium(self.config.chromium_path, self.config.image_width, self.config.image_height) as browser:
+            # Relative asset URLs in the template are resolved against build directory
+            with metrics.span("render.screenshot"):
+                screenshot = browser.screenshot(html, base_url=f"file://{self.workdir}/")
+
+        logger.info("Screenshot ready")
+
+        black_buffer, red_buffer = self._pack_planes(Image.open(io.BytesIO(screenshot)))
+
+        logger.info("Image rendered")
+
+        return black_buffer, red_buffer
+
+    def _build_html(self, calendar: Calendar, battery_status: BatteryStatus = None, weather_forecast: ForecastDay = None) -> str:
+        templates_path = f"{pathlib.Path(__file__).parent.parent.absolute()}/template"
+        environment = Environment(loader=FileSystemLoader(templates_path))
+        template = environment.get_template("calendar_template.jinja2")
+
+        assets = AssetBundle(self.workdir)
+        context = dict(
+            asset=assets.get_image,
+            calendar=calendar,
+            battery_icon=self._get_battery_icon(battery_status),
+            detailed_weeks=self.config.detailed_weeks,
+            height=self.config.image_height,
+            i18n=self.config.i18n,
+            max_events_per_day=self.config.max_events_per_day,
+            month_number=int(calendar.today.strftime("%-m")),
+            no_wifi=calendar.offline_events,
+            number_of_weeks=self._calculate_maximum_number_of_weeks(calendar),
+            preview_months=list(get_months_preview(self.config.number_of_months)),
+            width=self.config.image_width,
+            today=calendar.today,
+            today_day_number=int(calendar.today.strftime("%-d")),
+            weather_forecast=weather_forecast,
+        )
+
+        # First pass tells which characters are displayed, fonts are subset to them in the second one
+        html = template.render(font_faces=[], **context)
+        html = template.render(font_faces=assets.get_font_faces(get_text(html)), **context)
+
+        logger.info("HTML rendered")
+
+        return html
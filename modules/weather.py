@@ -6,6 +6,7 @@ import requests
 
 from enum import Enum
 from modules.config import Config
+from modules.http import get_session
 from pydantic import BaseModel
 from pytz import timezone
 from typing import List, Optional
@@ -171,8 +172,9 @@ class WeatherApiForecastResponse(BaseModel):
 
 
 class Weather:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, session: requests.Session = None):
         self.config = config
+        self.session = session or get_session()
         self.number_of_forecast_days = 1
         self.timezone = timezone(config.timezone)
 
@@ -188,7 +190,7 @@ class Weather:
         ]
         url = f"https://api.weatherapi.com/v1/forecast.json?{'&'.join(parameters)}"
         try:
-            result = requests.get(url)
+            result = self.session.get(url)
             data = json.loads(result.text)
         except Exception:
             logger.error(f"Failed to fetch weather forecast", exc_info=True)
@@ -0,0 +1,238 @@
+import json
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import pytest
+
+from modules.caldav import CalDavCollection
+from modules.http import Session
+
+
+TOKEN_PREFIX = "http://example.invalid/sync/"
+
+
+def get_object(uid, summary):
+    return (
+        "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nBEGIN:VEVENT\r\n"
+        f"UID:{uid}\r\nSUMMARY:{summary}\r\nDTSTART:20261020T100000Z\r\nDTEND:20261020T110000Z\r\n"
+        "END:VEVENT\r\nEND:VCALENDAR\r\n"
+    )
+
+
+class DavServer:
+    # Calendar collection answering sync-collection and calendar-multiget REPORTs, every change gets a new version
+    def __init__(self):
+        self.objects = {}
+        self.changed_at = {}
+        self.version = 0
+        # Tokens older than this are rejected, as if the server forgot them
+        self.first_valid_version = 0
+        # Sync answers carry only ETags, data has to be fetched with multiget
+        self.omit_data = False
+        # Sync answers list at most this many changes, the rest is left for the next round
+        self.page_size = None
+        # Hrefs as written in multiget answers, and hrefs multiget leaves out
+        self.multiget_href = lambda href: href
+        self.lost = set()
+        self.reports = []
+
+    def put(self, href, data):
+        self.version += 1
+        self.objects[href] = (f'"{self.version}"', data)
+        self.changed_at[href] = self.version
+
+    def delete(self, href):
+        self.version += 1
+        del self.objects[href]
+        self.changed_at[href] = self.version
+
+    def report(self, body):
+        self.reports.append("sync-collection" if "sync-collection" in body else "calendar-multiget")
+        if "sync-collection" in body:
+            return self._sync(re.search(r"<D:sync-token>(.*?)</D:sync-token>", body).group(1))
+        return 207, self._multistatus(
+            self._response(self.multiget_href(href), self.objects[href])
+            for href in re.findall(r"<D:href>(.*?)</D:href>", body)
+            if href not in self.lost
+        )
+
+    def _sync(self, token):
+        since = int(token[len(TOKEN_PREFIX):]) if token else 0
+        if token and since < self.first_valid_version:
+            return 403, '<?xml version="1.0"?><D:error xmlns:D="DAV:"><D:valid-sync-token/></D:error>'
+        changes = sorted(
+            (version, href) for href, version in self.changed_at.items()
+            if version > since and (token or href in self.objects)
+        )
+        responses = []
+        truncated = self.page_size is not None and len(changes) > self.page_size
+        if truncated:
+            changes = changes[:self.page_size]
+        for _, href in changes:
+            if href in self.objects:
+                responses.append(self._response(href, self.objects[href], omit_data=self.omit_data))
+            else:
+                responses.append(f"<D:response><D:href>{href}</D:href><D:status>HTTP/1.1 404 Not Found</D:status></D:response>")
+        if truncated:
+            responses.append("<D:response><D:href>/cal/</D:href><D:status>HTTP/1.1 507 Insufficient Storage</D:status></D:response>")
+        version = changes[-1][0] if truncated else self.version
+        return 207, self._multistatus(responses, f"<D:sync-token>{TOKEN_PREFIX}{version}</D:sync-token>")
+
+    def _response(self, href, calendar_object, omit_data=False):
+        etag, data = calendar_object
+        calendar_data = "" if omit_data else f"<C:calendar-data>{escape(data)}</C:calendar-data>"
+        return (
+            f"<D:response><D:href>{href}</D:href><D:propstat><D:prop><D:getetag>{etag}</D:getetag>{calendar_data}"
+            "</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>"
+        )
+
+    def _multistatus(self, responses, extra=""):
+        return (
+            '<?xml version="1.0"?><D:multistatus xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+            f'{"".join(responses)}{extra}</D:multistatus>'
+        )
+
+
+@pytest.fixture
+def server():
+    dav_server = DavServer()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_REPORT(self):
+            status, body = dav_server.report(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+            content = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=http_server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    dav_server.url = f"http://127.0.0.1:{http_server.server_port}/cal/"
+    yield dav_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def sync(server, tmp_path):
+    collection = CalDavCollection(Session(), server.url, str(tmp_path / "store.json"))
+
+    def sync_collection():
+        content_hash = collection.sync(str(tmp_path / "calendar.ics"))
+        with open(tmp_path / "calendar.ics") as ics_file:
+            content = ics_file.read()
+        with open(tmp_path / "store.json") as store_file:
+            store = json.load(store_file)
+        return content_hash, content, store
+
+    return sync_collection
+
+
+def get_summaries(content):
+    return re.findall(r"SUMMARY:(.*)", content)
+
+
+def test_initial_sync(server, sync):
+    server.put("/cal/1.ics", get_object(1, "First"))
+    server.put("/cal/2.ics", get_object(2, "Second"))
+
+    _, content, store = sync()
+
+    assert get_summaries(content) == ["First", "Second"]
+    assert store["token"] == f"{TOKEN_PREFIX}2"
+    assert server.reports == ["sync-collection"]
+
+
+def test_delta_adds_changes_and_removes_objects(server, sync):
+    server.put("/cal/1.ics", get_object(1, "First"))
+    server.put("/cal/2.ics", get_object(2, "Second"))
+    first_hash, _, _ = sync()
+
+    server.put("/cal/1.ics", get_object(1, "First changed"))
+    server.put("/cal/3.ics", get_object(3, "Third"))
+    server.delete("/cal/2.ics")
+    content_hash, content, store = sync()
+
+    assert get_summaries(content) == ["First changed", "Third"]
+    assert store["token"] == f"{TOKEN_PREFIX}5"
+    assert sorted(store["objects"]) == ["/cal/1.ics", "/cal/3.ics"]
+    assert content_hash != first_hash
+
+
+def test_unchanged_collection_keeps_content_hash(server, sync):
+    server.put("/cal/1.ics", get_object(1, "First"))
+    first_hash, _, _ = sync()
+
+    content_hash, content, _ = sync()
+
+    assert content_hash == first_hash
+    assert get_summaries(content) == ["First"]
+
+
+def test_truncated_changes_continue_in_next_round(server, sync):
+    for index in range(5):
+        server.put(f"/cal/{index}.ics", get_object(index, f"Event {index}"))
+    server.page_size = 2
+
+    _, content, store = sync()
+
+    assert get_summaries(content) == [f"Event {index}" for index in range(5)]
+    assert store["token"] == f"{TOKEN_PREFIX}5"
+    assert server.reports == ["sync-collection"] * 3
+
+
+def test_invalid_sync_token_starts_over(server, sync):
+    server.put("/cal/1.ics", get_object(1, "First"))
+    server.put("/cal/2.ics", get_object(2, "Second"))
+    sync()
+
+    server.delete("/cal/2.ics")
+    server.put("/cal/3.ics", get_object(3, "Third"))
+    server.first_valid_version = server.version
+    server.reports.clear()
+    _, content, store = sync()
+
+    assert get_summaries(content) == ["First", "Third"]
+    assert sorted(store["objects"]) == ["/cal/1.ics", "/cal/3.ics"]
+    assert store["token"] == f"{TOKEN_PREFIX}4"
+    assert server.reports == ["sync-collection", "sync-collection"]
+
+
+def test_data_left_out_of_changes_is_fetched_with_multiget(server, sync):
+    server.omit_data = True
+    server.put("/cal/1.ics", get_object(1, "First"))
+    server.put("/cal/event 2.ics", get_object(2, "Second"))
+    # Answer uses absolute URLs and percent-encoding, unlike the sync report
+    server.multiget_href = lambda href: f"{server.url[:-len('/cal/')]}{href.replace(' ', '%20')}"
+
+    _, content, store = sync()
+
+    assert get_summaries(content) == ["First", "Second"]
+    assert sorted(store["objects"]) == ["/cal/1.ics", "/cal/event 2.ics"]
+    assert server.reports == ["sync-collection", "calendar-multiget"]
+
+
+def test_object_left_out_of_multiget_keeps_previous_token(server, sync):
+    server.put("/cal/1.ics", get_object(1, "First"))
+    sync()
+
+    server.omit_data = True
+    server.put("/cal/1.ics", get_object(1, "First changed"))
+    server.lost.add("/cal/1.ics")
+    with pytest.raises(ValueError):
+        sync()
+
+    server.lost.clear()
+    _, content, store = sync()
+
+    assert get_summaries(content) == ["First changed"]
+    assert store["token"] == f"{TOKEN_PREFIX}2"
@@ -0,0 +1,155 @@
+import json
+import pathlib
+import shutil
+
+from datetime import datetime
+
+import pytest
+from pytz import timezone
+
+from modules.calendar import Calendar
+from modules.config import Config
+
+
+ROOT_PATH = pathlib.Path(__file__).parent.parent
+FIXTURES_PATH = pathlib.Path(__file__).parent / "fixtures"
+# Displayed window is 2026-10-19 to 2026-11-16, both European and American DST ends fall into it
+TODAY = timezone("Europe/Warsaw").localize(datetime(2026, 10, 21))
+
+
+class FixedCalendar(Calendar):
+    @property
+    def today(self) -> datetime:
+        return TODAY
+
+
+@pytest.fixture
+def calendar(tmp_path):
+    with open(ROOT_PATH / "config.sample.json") as config_file:
+        data = json.load(config_file)
+    data["weather"]["api_key"] = "x"
+    data.update(number_of_weeks=4, timezone="Europe/Warsaw", calendars=[{"url": "https://example.invalid/a.ics"}])
+    calendar = FixedCalendar(Config(**data))
+    calendar.workdir = str(tmp_path)
+    return calendar
+
+
+def get_days(calendar):
+    # Times are compared in calendar time zone, ends computed across a DST change may still have the offset of the start
+    def local(moment):
+        return moment.astimezone(calendar.timezone).isoformat()
+
+    return {
+        label: [
+            [event.summary, event.start_time, event.all_day, local(event.start_date), local(event.end_date)]
+            for event in day.events
+        ]
+        for label, day in calendar.days.items()
+    }
+
+
+def load_corpus(calendar, content_hash=None):
+    # Index of expanded events is saved next to the feed, so the feed is read from the working directory
+    ics_path = shutil.copy(FIXTURES_PATH / "recurrence.ics", calendar.workdir)
+    calendar._load_calendar_events(calendar.config.calendars[0], str(ics_path), content_hash)
+    calendar._sort_events()
+
+
+def load_fixture(name):
+    with open(FIXTURES_PATH / name) as fixture_file:
+        return json.load(fixture_file)
+
+
+def get_events(days):
+    # Occurrences of every event, order of events within a day doesn't matter
+    events = {}
+    for label, occurrences in days.items():
+        for summary, *occurrence in occurrences:
+            events.setdefault(summary, []).append([label] + occurrence)
+    return {summary: sorted(occurrences, key=str) for summary, occurrences in events.items()}
+
+
+# recurrence.baseline.json holds what the calendar showed before the streaming parser, when feeds were read with
+# the ics library. Events listed here are shown differently now, all the other ones exactly as before.
+BASELINE_DIFFERENCES = {
+    # TZID events were expanded in the UTC offset of DTSTART, occurrences on the other side of a DST change
+    # were an hour off, so EXDATEs in local time missed them too
+    "Standup": "an hour late until 2026-10-25, EXDATE on 2026-10-23 ignored",
+    "Pills": "an hour late until 2026-10-25",
+    "Office hours": "an hour late until 2026-10-25",
+    "Course": "an hour early after 2026-10-25",
+    "Review": "an hour early after 2026-10-25, EXDATE on 2026-11-11 ignored",
+    "New York sync": "an hour late until 2026-11-01, DTSTART is in New York winter time",
+    # Floating times were read as UTC
+    "Morning run": "at 09:00 until 2026-10-25 and at 08:00 after it, instead of 07:00",
+    # All-day dates were read as UTC midnight
+    "Birthday": "starts at 01:00",
+    "Conference": "starts at 01:00",
+    "Payday": "starts at 01:00",
+    "Weekend away": "starts at 02:00 before 2026-10-25 and at 01:00 after it",
+    # Events without RRULE weren't expanded
+    "Rdate only": "RDATE ignored, shown on DTSTART only",
+}
+
+
+def test_recurrence_corpus(calendar):
+    # Overrides with RECURRENCE-ID are shown as events of their own, next to the occurrence of the master event
+    # they replace, as they always were
+    load_corpus(calendar)
+    assert get_days(calendar) == load_fixture("recurrence.expected.json")
+
+
+def test_recurrence_corpus_differs_from_baseline_only_in_fixed_events(calendar):
+    load_corpus(calendar)
+    events = get_events(get_days(calendar))
+    baseline_events = get_events(load_fixture("recurrence.baseline.json"))
+
+    assert events.keys() == baseline_events.keys()
+    for summary, occurrences in events.items():
+        if summary in BASELINE_DIFFERENCES:
+            assert occurrences != baseline_events[summary], summary
+        else:
+            assert occurrences == baseline_events[summary], summary
+
+
+def test_recurrence_corpus_from_index(calendar, tmp_path):
+    load_corpus(calendar, content_hash="corpus")
+    expanded = get_days(calendar)
+
+    indexed_calendar = FixedCalendar(calendar.config)
+    indexed_calendar.workdir = str(tmp_path)
+    load_corpus(indexed_calendar, content_hash="corpus")
+    assert get_days(indexed_calendar) == expanded
+
+
+def count_index_saves(calendar, monkeypatch):
+    saved = []
+    save_event_index = calendar._save_event_index
+    monkeypatch.setattr(calendar, "_save_event_index", lambda *args: saved.append(args) or save_event_index(*args))
+    return saved
+
+
+def test_unchanged_index_is_not_saved(calendar, tmp_path, monkeypatch):
+    # Feed without a content hash is always read, its index is only saved when the occurrences differ
+    load_corpus(calendar)
+
+    indexed_calendar = FixedCalendar(calendar.config)
+    indexed_calendar.workdir = str(tmp_path)
+    saved = count_index_saves(indexed_calendar, monkeypatch)
+    load_corpus(indexed_calendar)
+
+    assert saved == []
+    assert get_days(indexed_calendar) == get_days(calendar)
+
+
+def test_changed_content_hash_is_saved(calendar, tmp_path, monkeypatch):
+    load_corpus(calendar, content_hash="corpus")
+
+    indexed_calendar = FixedCalendar(calendar.config)
+    indexed_calendar.workdir = str(tmp_path)
+    saved = count_index_saves(indexed_calendar, monkeypatch)
+    load_corpus(indexed_calendar, content_hash="corpus with new DTSTAMP")
+
+    assert [index["content_hash"] for _, index in saved] == ["corpus with new DTSTAMP"]
+    with open(tmp_path / "recurrence.events.json") as index_file:
+        assert json.load(index_file)["content_hash"] == "corpus with new DTSTAMP"
@@ -0,0 +1,105 @@
+import os
+import random
+
+import pytest
+
+# Driver talks to the simulated panel, it has to be selected before the driver is imported
+os.environ["MAGINKCAL_EPD"] = "simulator"
+
+import display.epd12in48b as eink  # noqa: E402
+from display import epdconfig, epdsim  # noqa: E402
+from display.display import Display  # noqa: E402
+
+
+simulator = epdconfig.implementation
+
+
+def get_planes(seed):
+    generator = random.Random(seed)
+    return (
+        bytes(generator.getrandbits(8) for _ in range(eink.EPD_BUFFER_SIZE)),
+        bytes(generator.getrandbits(8) for _ in range(eink.EPD_BUFFER_SIZE)),
+    )
+
+
+def change_byte(buffer, row, column):
+    changed = bytearray(buffer)
+    changed[row * eink.EPD_ROW_BYTES + column] ^= 0xff
+    return bytes(changed)
+
+
+def update(display_service, black_buffer, red_buffer, **kwargs):
+    # Returns bus statistics of the update and how many times each controller refreshed
+    refreshes = {controller.name: controller.refreshes for controller in simulator.controllers}
+    simulator.reset_stats()
+    display_service.update(black_buffer, red_buffer, **kwargs)
+    report = simulator.get_report()
+    refreshed = {name for name, count in report["controller_refreshes"].items() if count != refreshes[name]}
+    return report, refreshed
+
+
+@pytest.fixture
+def display_service(tmp_path):
+    assert isinstance(simulator, epdsim.Simulator)
+    display_service = Display(eink.EPD_WIDTH, eink.EPD_HEIGHT)
+    display_service.workdir = str(tmp_path)
+    display_service.frame_path = str(tmp_path / "frame")
+    display_service.state_path = str(tmp_path / "display_state.json")
+    yield display_service
+    display_service.sleep()
+
+
+def test_full_update(display_service):
+    black_buffer, red_buffer = get_planes(1)
+
+    report, refreshed = update(display_service, black_buffer, red_buffer)
+
+    assert simulator.get_frame() == (black_buffer, red_buffer)
+    assert report["spi_bytes"] == 320794
+    assert report["spi_calls"] == 90
+    assert report["refreshes"] == 4
+    assert refreshed == {"M1", "S1", "M2", "S2"}
+
+
+def test_unchanged_update_sends_nothing(display_service):
+    black_buffer, red_buffer = get_planes(2)
+    update(display_service, black_buffer, red_buffer)
+
+    report, refreshed = update(display_service, black_buffer, red_buffer)
+
+    assert simulator.get_frame() == (black_buffer, red_buffer)
+    assert report["spi_bytes"] == 0
+    assert report["refreshes"] == 0
+    assert refreshed == set()
+
+
+def test_bottom_half_change_updates_bottom_controllers(display_service):
+    black_buffer, red_buffer = get_planes(3)
+    update(display_service, black_buffer, red_buffer)
+    changed_red_buffer = change_byte(red_buffer, eink.EPD_HEIGHT - 1, eink.EPD_ROW_BYTES - 1)
+
+    report, refreshed = update(display_service, black_buffer, changed_red_buffer)
+
+    assert simulator.get_frame() == (black_buffer, changed_red_buffer)
+    assert refreshed == {"M1", "S1"}
+    assert report["refreshes"] == 2
+    assert report["spi_bytes"] < eink.EPD_BUFFER_SIZE + 16
+
+
+def test_partial_window(display_service):
+    black_buffer, red_buffer = get_planes(4)
+    update(display_service, black_buffer, red_buffer)
+    changed_black_buffer = change_byte(black_buffer, 100, 10)
+    dirty_rects = display_service.get_dirty_rects(changed_black_buffer, red_buffer, 1)
+
+    report, refreshed = update(display_service, changed_black_buffer, red_buffer, dirty_rects=dirty_rects)
+
+    assert dirty_rects == [(80, 100, 88, 101)]
+    assert simulator.get_frame() == (changed_black_buffer, red_buffer)
+    assert refreshed == {"S2"}
+    assert report["refreshes"] == 1
+    sent = [data for _, operation, data in (entry[:3] for entry in simulator.log) if operation == "spi"]
+    assert sent[:2] == [bytes([epdsim.PARTIAL_IN]), bytes([epdsim.PARTIAL_WINDOW])]
+    # Window of S2 in its own coordinates: horizontal start and end, vertical start and end
+    window = next(controller for controller in simulator.controllers if controller.name == "S2").registers[epdsim.PARTIAL_WINDOW]
+    assert bytes(window[:8]) == bytes([0, 80, 0, 87, 0, 100, 0, 100])
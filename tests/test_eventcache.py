@@ -0,0 +1,98 @@
+import zlib
+
+from datetime import datetime
+
+import pytest
+from pytz import timezone
+
+from modules import eventcache
+from modules.calendar import EventRecord
+
+
+WARSAW = timezone("Europe/Warsaw")
+FIRST_DAY = datetime(2026, 10, 19).toordinal()
+
+
+def get_days():
+    start = WARSAW.localize(datetime(2026, 10, 19, 9, 30))
+    return [
+        (FIRST_DAY, [
+            EventRecord(False, WARSAW.localize(datetime(2026, 10, 19, 10)), False, start, "09:30", "Standup"),
+            EventRecord(True, WARSAW.localize(datetime(2026, 10, 22)), True, WARSAW.localize(datetime(2026, 10, 19)),
+                        None, "Zażółć gęślą jaźń"),
+        ]),
+        (FIRST_DAY + 1, []),
+        (FIRST_DAY + 2, [
+            EventRecord(False, WARSAW.localize(datetime(2026, 10, 21, 13)), True,
+                        WARSAW.localize(datetime(2026, 10, 21, 12)), "12:00", "Lunch"),
+        ]),
+    ]
+
+
+def get_cached(days):
+    return {
+        ordinal: [
+            (event.all_day, event.end_date, event.important, event.start_date, event.start_time, event.summary)
+            for event in events
+        ]
+        for ordinal, events in days
+    }
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    path = str(tmp_path / "events.bin")
+    eventcache.save_days(path, get_days())
+    return path
+
+
+def rewrite(path, change):
+    with open(path, "rb") as cache_file:
+        data = bytearray(cache_file.read())
+    change(data)
+    with open(path, "wb") as cache_file:
+        cache_file.write(data)
+
+
+def test_round_trip(cache_path):
+    days = eventcache.load_days(cache_path, range(FIRST_DAY, FIRST_DAY + 3), WARSAW)
+
+    assert days == get_cached(get_days())
+    assert days[FIRST_DAY][0][1].tzinfo.zone == "Europe/Warsaw"
+
+
+def test_only_requested_days_are_read(cache_path):
+    days = eventcache.load_days(cache_path, [FIRST_DAY + 2, FIRST_DAY + 7], WARSAW)
+
+    assert days == {FIRST_DAY + 2: get_cached(get_days())[FIRST_DAY + 2]}
+
+
+def test_truncated_file_is_rejected(cache_path):
+    rewrite(cache_path, lambda data: data.__delitem__(slice(-10, None)))
+
+    with pytest.raises(ValueError):
+        eventcache.load_days(cache_path, [FIRST_DAY], WARSAW)
+
+
+def test_flipped_byte_is_rejected(cache_path):
+    def flip(data):
+        data[len(data) // 2] ^= 0x01
+
+    rewrite(cache_path, flip)
+
+    with pytest.raises(ValueError, match="damaged"):
+        eventcache.load_days(cache_path, [FIRST_DAY], WARSAW)
+
+
+@pytest.mark.parametrize("magic, version", [(b"XXXX", eventcache.VERSION), (eventcache.MAGIC, eventcache.VERSION + 1)])
+def test_other_format_is_rejected(cache_path, magic, version):
+    # Checksum is valid, only the header tells the file apart
+    def change_header(data):
+        _, _, number_of_days = eventcache.HEADER.unpack_from(data)
+        eventcache.HEADER.pack_into(data, 0, magic, version, number_of_days)
+        data[-eventcache.TRAILER.size:] = eventcache.TRAILER.pack(zlib.crc32(data[:-eventcache.TRAILER.size]))
+
+    rewrite(cache_path, change_header)
+
+    with pytest.raises(ValueError, match="Unsupported"):
+        eventcache.load_days(cache_path, [FIRST_DAY], WARSAW)
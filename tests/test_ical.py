@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from pytz import timezone
+
+from modules.ical import build_event, read_components
+
+
+WARSAW = timezone("Europe/Warsaw")
+
+
+def read_event(*properties):
+    lines = ["BEGIN:VCALENDAR", "BEGIN:VEVENT", "UID:1@maginkcal.invalid", "SUMMARY:Event", *properties,
+             "END:VEVENT", "END:VCALENDAR"]
+    (component, timezones), = read_components(lines, WARSAW)
+    return build_event(component, timezones)
+
+
+def test_rdate_only_event_occurs_at_dtstart():
+    event = read_event(
+        "DTSTART:20261013T160000Z",
+        "DTEND:20261013T170000Z",
+        "RDATE:20261020T160000Z,20261022T160000Z",
+    )
+    occurrences, first = event.get_occurrences(
+        WARSAW.localize(datetime(2026, 10, 12)), WARSAW.localize(datetime(2026, 10, 26)), WARSAW
+    )
+    assert occurrences == [
+        WARSAW.localize(datetime(2026, 10, 13, 18)),
+        WARSAW.localize(datetime(2026, 10, 20, 18)),
+        WARSAW.localize(datetime(2026, 10, 22, 18)),
+    ]
+    assert first == WARSAW.localize(datetime(2026, 10, 13, 18))
+
+
+def test_rdate_only_event_dtstart_can_be_excluded():
+    event = read_event(
+        "DTSTART:20261013T160000Z",
+        "DTEND:20261013T170000Z",
+        "RDATE:20261020T160000Z",
+        "EXDATE:20261013T160000Z",
+    )
+    occurrences, _ = event.get_occurrences(
+        WARSAW.localize(datetime(2026, 10, 12)), WARSAW.localize(datetime(2026, 10, 26)), WARSAW
+    )
+    assert occurrences == [WARSAW.localize(datetime(2026, 10, 20, 18))]
+
+
+def test_rdate_only_event_long_after_dtstart():
+    event = read_event(
+        "DTSTART;VALUE=DATE:20200105",
+        "DTEND;VALUE=DATE:20200106",
+        "RDATE:20261014T000000",
+    )
+    occurrences, first = event.get_occurrences(
+        WARSAW.localize(datetime(2026, 10, 12)), WARSAW.localize(datetime(2026, 10, 26)), WARSAW
+    )
+    assert occurrences == [WARSAW.localize(datetime(2026, 10, 14))]
+    assert first == WARSAW.localize(datetime(2020, 1, 5))
@@ -0,0 +1,64 @@
+import pytest
+
+from modules import metrics
+
+
+@pytest.fixture
+def metrics_path(tmp_path):
+    metrics.start_run()
+    return str(tmp_path / "metrics.jsonl")
+
+
+def record_run(metrics_path, status="ok", textfile_path=None):
+    with metrics.span("calendar", url="https://example.invalid/a.ics"):
+        pass
+    with metrics.span("calendar"):
+        pass
+    metrics.set_value("events", 12)
+    record = metrics.finish_run(status, textfile_path=textfile_path, path=metrics_path)
+    metrics.start_run()
+    return record
+
+
+def test_round_trip(metrics_path, tmp_path):
+    record = record_run(metrics_path, textfile_path=str(tmp_path / "maginkcal.prom"))
+
+    assert metrics.read_records(metrics_path) == [record]
+    assert record["status"] == "ok"
+    assert [span["name"] for span in record["spans"]] == ["calendar", "calendar"]
+    assert record["spans"][0]["attributes"] == {"url": "https://example.invalid/a.ics"}
+    assert record["stages"]["calendar"] == pytest.approx(sum(span["duration"] for span in record["spans"]), abs=1e-6)
+    assert record["values"] == {"events": 12}
+    textfile = (tmp_path / "maginkcal.prom").read_text()
+    assert 'maginkcal_value{name="events"} 12' in textfile
+    assert textfile.endswith("# EOF\n")
+
+
+def test_span_is_recorded_when_block_raises(metrics_path):
+    with pytest.raises(RuntimeError):
+        with metrics.span("weather"):
+            raise RuntimeError()
+    record = metrics.finish_run("error", path=metrics_path)
+
+    assert [span["name"] for span in record["spans"]] == ["weather"]
+    assert metrics.read_records(metrics_path) == [record]
+
+
+def test_cut_line_is_skipped(metrics_path):
+    record = record_run(metrics_path)
+    with open(metrics_path, "a") as metrics_file:
+        metrics_file.write('{"time": "2026-10-')
+
+    assert metrics.read_records(metrics_path) == [record]
+
+
+def test_rotation_keeps_previous_file(metrics_path, monkeypatch):
+    record_run(metrics_path)
+    monkeypatch.setattr(metrics, "METRICS_MAX_BYTES", 1)
+    second = record_run(metrics_path)
+    third = record_run(metrics_path)
+
+    # Every rotation replaces the previous file, only the two newest files are kept
+    assert metrics.read_records(metrics_path) == [second, third]
+    with open(f"{metrics_path}.1") as rotated_file:
+        assert rotated_file.read().count("\n") == 1
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+from PIL import Image
+
+from modules.planes import pack_planes, split_planes
+
+
+# Both sizes are multiples of 8, so rows of the rotated image also start on a byte boundary
+WIDTH = 48
+HEIGHT = 32
+
+
+def get_image(seed):
+    # Random colors for dithering, channels from a few values for pixels on the edge of red and black planes
+    generator = random.Random(seed)
+    image = Image.new("RGB", (WIDTH, HEIGHT))
+    image.putdata([
+        tuple(generator.randrange(256) for _ in range(3)) if generator.random() < 0.5
+        else tuple(generator.choice((0, 127, 128, 255)) for _ in range(3))
+        for _ in range(WIDTH * HEIGHT)
+    ])
+    return image
+
+
+def split_baseline(image, rotate):
+    # Per pixel loop the renderer used before planes were split with channel operations
+    red_image = image.copy()
+    red_pixels = red_image.load()
+    black_image = image.copy()
+    black_pixels = black_image.load()
+    for i in range(image.size[0]):
+        for j in range(image.size[1]):
+            if red_pixels[i, j][0] <= red_pixels[i, j][1] and red_pixels[i, j][0] <= red_pixels[i, j][2]:
+                red_pixels[i, j] = (255, 255, 255)
+            else:
+                red_pixels[i, j] = (0, 0, 0)
+            if black_pixels[i, j][0] > black_pixels[i, j][1] and black_pixels[i, j][0] > black_pixels[i, j][2]:
+                black_pixels[i, j] = (255, 255, 255)
+    return black_image.rotate(rotate, expand=True), red_image.rotate(rotate, expand=True)
+
+
+def pack_baseline(image):
+    # Packing loop of the driver, bits are set for white pixels of the dithered image
+    converted = image.convert("1")
+    width, height = converted.size
+    pixels = converted.load()
+    buffer = bytearray(width * height // 8)
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y] >= 127:
+                buffer[(x + y * width) // 8] |= 0x80 >> (x % 8)
+    return bytes(buffer)
+
+
+@pytest.mark.parametrize("rotate", [0, 90, 180])
+@pytest.mark.parametrize("seed", [1, 2])
+def test_planes_match_baseline(seed, rotate):
+    image = get_image(seed)
+    black_image, red_image = split_baseline(image, rotate)
+
+    black_buffer, red_buffer = pack_planes(*split_planes(image), rotate)
+
+    assert black_buffer == pack_baseline(black_image)
+    # Driver used to invert the red buffer itself, now it comes with bits set for red pixels
+    assert red_buffer == bytes(byte ^ 0xff for byte in pack_baseline(red_image))
+
+
+def test_black_plane_is_dithered():
+    # Mid gray comes out as a mix of black and white pixels, not as a threshold
+    image = Image.new("RGB", (WIDTH, HEIGHT), (128, 128, 128))
+
+    black_buffer, red_buffer = pack_planes(*split_planes(image))
+
+    assert black_buffer == pack_baseline(image)
+    assert 0 < sum(bin(byte).count("1") for byte in black_buffer) < WIDTH * HEIGHT
+    assert not any(red_buffer)
@@ -0,0 +1,169 @@
+import json
+import os
+import pathlib
+
+from datetime import datetime, timedelta
+
+import pytest
+from pytz import timezone
+
+from modules import render
+from modules.calendar import Day, Event
+from modules.config import Config, I18nConfig
+from modules.power import BatteryStatus
+from modules.render import FINGERPRINT_CONFIG_FIELDS, TemplateRenderer, get_renderer
+from modules.weather import ForecastConditionEnum, ForecastDay, ForecastHour
+
+
+ROOT_PATH = pathlib.Path(__file__).parent.parent
+WARSAW = timezone("Europe/Warsaw")
+# A value different from config.sample.json for every field the fingerprint includes
+CHANGED_CONFIG = {
+    "black_plane_threshold": 10,
+    "detailed_weeks": 2,
+    "i18n": I18nConfig(no_events="Brak wydarzeń"),
+    "image_height": 900,
+    "image_width": 1200,
+    "max_events_per_day": 3,
+    "number_of_months": 3,
+    "number_of_weeks": 4,
+    "red_plane_threshold": 10,
+    "renderer": "pillow",
+    "rotate": 90,
+    "screen_height": 1000,
+    "screen_width": 1300,
+}
+
+
+class StubCalendar:
+    def __init__(self, today=WARSAW.localize(datetime(2026, 10, 19)), summary="Standup"):
+        self.today = today
+        self.offline_events = False
+        self.days = {}
+        for index in range(28):
+            day = today + timedelta(days=index)
+            start = day + timedelta(hours=9)
+            events = [
+                Event(all_day=False, end_date=start + timedelta(hours=1), start_date=start, start_time="09:00",
+                      summary=summary if index == 2 else "Standup")
+            ]
+            self.days[day.strftime("%Y-%m-%d")] = Day(date_label=day.strftime("%Y-%m-%d"), datetime=day, events=events,
+                                                      number=day.day)
+
+
+def get_weather(temperature=12):
+    return ForecastDay(day="2026-10-19", hours=[
+        ForecastHour(condition=ForecastConditionEnum.sunny, hour=hour, is_day=True, temperature=temperature)
+        for hour in ("06:00", "12:00", "18:00")
+    ])
+
+
+@pytest.fixture
+def config():
+    with open(ROOT_PATH / "config.sample.json") as config_file:
+        data = json.load(config_file)
+    data["weather"]["api_key"] = "x"
+    return Config(**data)
+
+
+@pytest.fixture
+def renderer(config, tmp_path):
+    renderer = TemplateRenderer(config)
+    renderer.fingerprint_path = str(tmp_path / "fingerprint")
+    return renderer
+
+
+def get_fingerprint(renderer, calendar=None, battery_status=BatteryStatus(level=100, is_charging=False),
+                    weather_forecast=None):
+    return renderer.get_fingerprint(
+        calendar or StubCalendar(), battery_status=battery_status, weather_forecast=weather_forecast or get_weather()
+    )
+
+
+def test_equal_inputs_give_equal_fingerprints(renderer):
+    assert get_fingerprint(renderer) == get_fingerprint(renderer)
+
+
+@pytest.mark.parametrize("changes", [
+    {"calendar": StubCalendar(summary="Standup moved")},
+    {"calendar": StubCalendar(today=WARSAW.localize(datetime(2026, 10, 20)))},
+    {"weather_forecast": get_weather(temperature=13)},
+    {"battery_status": BatteryStatus(level=60, is_charging=False)},
+    {"battery_status": None},
+], ids=["events", "today", "weather", "battery", "no battery"])
+def test_displayed_content_changes_fingerprint(renderer, changes):
+    assert get_fingerprint(renderer, **changes) != get_fingerprint(renderer)
+
+
+def test_battery_level_within_icon_keeps_fingerprint(renderer):
+    assert (
+        get_fingerprint(renderer, battery_status=BatteryStatus(level=60, is_charging=False))
+        == get_fingerprint(renderer, battery_status=BatteryStatus(level=65, is_charging=False))
+    )
+
+
+def test_offline_events_change_fingerprint(renderer):
+    calendar = StubCalendar()
+    calendar.offline_events = True
+
+    assert get_fingerprint(renderer, calendar=calendar) != get_fingerprint(renderer)
+
+
+@pytest.mark.parametrize("field", sorted(FINGERPRINT_CONFIG_FIELDS))
+def test_config_fields_change_fingerprint(renderer, config, field):
+    assert set(CHANGED_CONFIG) == FINGERPRINT_CONFIG_FIELDS
+    changed_renderer = TemplateRenderer(config.copy(update={field: CHANGED_CONFIG[field]}))
+
+    assert get_fingerprint(changed_renderer) != get_fingerprint(renderer)
+
+
+def test_other_config_fields_keep_fingerprint(renderer, config):
+    changed_renderer = TemplateRenderer(config.copy(update={"wakeup_hours": ["05:00"], "calibration_cycles": 3}))
+
+    assert get_fingerprint(changed_renderer) == get_fingerprint(renderer)
+
+
+def test_layout_change_changes_fingerprint(renderer, tmp_path):
+    fingerprint = get_fingerprint(renderer)
+    layout_path = tmp_path / "layout.jinja2"
+    layout_path.write_bytes(pathlib.Path(renderer.layout_path).read_bytes() + b"\n")
+    renderer.layout_path = str(layout_path)
+
+    assert get_fingerprint(renderer) != fingerprint
+
+
+def test_asset_change_changes_fingerprint(renderer, tmp_path, monkeypatch):
+    icon_path = tmp_path / "assets" / "images" / "icon.png"
+    icon_path.parent.mkdir(parents=True)
+    icon_path.write_bytes(b"icon")
+    monkeypatch.setattr(render, "ASSETS_PATH", str(tmp_path / "assets"))
+    fingerprint = get_fingerprint(renderer)
+
+    os.utime(icon_path, ns=(0, icon_path.stat().st_mtime_ns + 1_000_000_000))
+
+    assert get_fingerprint(renderer) != fingerprint
+
+
+def test_saved_fingerprint_is_displayed(renderer):
+    fingerprint = get_fingerprint(renderer)
+    assert not renderer.is_displayed(fingerprint)
+
+    renderer.save_fingerprint(fingerprint)
+
+    assert renderer.is_displayed(fingerprint)
+    assert not renderer.is_displayed(get_fingerprint(renderer, weather_forecast=get_weather(temperature=13)))
+
+
+@pytest.mark.parametrize("weather_forecast", [get_weather(), ForecastDay(day="2026-10-19", hours=[]), None],
+                         ids=["weather", "no hours", "no weather"])
+def test_pillow_renderer_fills_planes(config, weather_forecast):
+    renderer = get_renderer(config.copy(update={"renderer": "pillow"}))
+
+    black_buffer, red_buffer = renderer.render(
+        StubCalendar(), battery_status=BatteryStatus(level=60, is_charging=False), weather_forecast=weather_forecast
+    )
+
+    assert len(black_buffer) == len(red_buffer) == config.screen_width * config.screen_height // 8
+    # Black buffer has bits set for white pixels, red buffer for red ones
+    assert any(byte != 0xff for byte in black_buffer)
+    assert any(red_buffer)